@@ -2,19 +2,68 @@
 PhysiTutor-AI - AI-native Physics Tutoring MVP
 FastAPI Application Entry Point
 """
+import asyncio
+import gzip
+import hashlib
+from contextlib import asynccontextmanager
+from email.utils import formatdate
 from pathlib import Path
-from fastapi import FastAPI
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, ORJSONResponse, Response
 
 from app.routes import session_router, dialogue_router
+from app.services.dialogue_manager import dialogue_manager
+from app.services.llm_service import aclose_async_client, llm_service
 from app.services.logger import dialogue_logger
+from app.utils.helpers import etag_matches
 from config.settings import settings
 
+try:
+    import brotli
+except ImportError:  # Optional: without it, text assets are only offered gzipped
+    brotli = None
+
 # Project root
 PROJECT_ROOT = Path(__file__).parent.parent
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize services on startup."""
+    from app.models.database import init_db
+    
+    print("=" * 50)
+    print("PhysiTutor-AI MVP Starting...")
+    print(f"Environment: {settings.app_env}")
+    print(f"Prompt Version: {settings.prompt_version}")
+    print(f"Gemini API: {'Configured' if settings.gemini_api_key else 'Not Configured'}")
+    
+    # Independent startup work runs concurrently on worker threads
+    print("Initializing database, question index and static cache...")
+    _, _, static_cache, _ = await asyncio.gather(
+        asyncio.to_thread(init_db),
+        asyncio.to_thread(dialogue_manager.load_questions),
+        asyncio.to_thread(_load_static_cache),
+        asyncio.to_thread(llm_service.prune_vision_cache),
+    )
+    app.state.static_cache = static_cache
+    print("✓ Database initialized")
+    
+    # Warm the LLM connection in the background; startup does not wait on the network
+    warmup_task = asyncio.create_task(llm_service.a_warmup())
+    
+    print(f"Frontend: http://localhost:8000/")
+    print(f"API Docs: http://localhost:8000/docs")
+    print("=" * 50)
+    yield
+    
+    warmup_task.cancel()
+    await aclose_async_client()
+    dialogue_logger.flush()
+
 # Create FastAPI app
 app = FastAPI(
     title="PhysiTutor-AI",
@@ -32,7 +81,9 @@ app = FastAPI(
     """,
     version="0.1.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS for frontend testing
@@ -44,82 +95,190 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that also tells browsers how long they may reuse a file."""
+
+    def __init__(self, *args, max_age: int = 86400, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = f"public, max-age={max_age}"
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", self.cache_control)
+        return response
+
+
 # Mount static files
 static_dir = PROJECT_ROOT / "static"
+uploads_dir = settings.uploads_dir
+
+
+# Registered before the /static mount so it takes precedence for uploads.
+@app.get("/static/uploads/{name}", include_in_schema=False)
+async def uploaded_file(name: str, request: Request):
+    """Serve uploaded images; names are UUID-based and never rewritten, so cache them for good."""
+    file_path = uploads_dir / name
+    if Path(name).name != name or not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    stat_result = file_path.stat()
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{int(stat_result.st_mtime)}-{stat_result.st_size}"',
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file_path, headers=headers, stat_result=stat_result)
+
+
 if static_dir.exists():
-    app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
+    app.mount("/static", CachedStaticFiles(directory=str(static_dir)), name="static")
 
 # Register routers
 app.include_router(session_router)
 app.include_router(dialogue_router)
 
+# Static JSON payloads, built once since settings do not change at runtime
+ROOT_INFO = {
+    "name": "PhysiTutor-AI",
+    "version": "0.1.0",
+    "description": "AI-native 引导型物理导师 MVP",
+    "frontend": "访问 /static/index.html 使用学生界面",
+    "docs": "/docs"
+}
+
+API_INFO = {
+    "name": "PhysiTutor-AI API",
+    "version": "0.1.0",
+    "docs": "/docs",
+    "endpoints": {
+        "session": {
+            "list_questions": "GET /session/",
+            "start": "POST /session/start",
+            "get": "GET /session/{session_id}",
+            "end": "POST /session/{session_id}/end"
+        },
+        "dialogue": {
+            "current_step": "GET /dialogue/{session_id}/current",
+            "submit_choice": "POST /dialogue/{session_id}/submit",
+            "history": "GET /dialogue/{session_id}/history",
+            "transfer": "POST /dialogue/{session_id}/transfer",
+            "reasoning": "POST /dialogue/{session_id}/reasoning",
+            "reasoning_stream": "POST /dialogue/{session_id}/reasoning/stream (SSE)"
+        }
+    }
+}
+
+HEALTH_PAYLOAD = {
+    "status": "healthy",
+    "env": settings.app_env,
+    "gemini_configured": bool(settings.gemini_api_key),
+    "prompt_version": settings.prompt_version
+}
+
+# Small root-level assets served from memory: name -> (media type, Cache-Control).
+# index.html changes between deploys, so clients revalidate it via ETag.
+STATIC_CACHED_ASSETS = {
+    "favicon.ico": ("image/x-icon", "public, max-age=31536000, immutable"),
+    "robots.txt": ("text/plain", "public, max-age=31536000, immutable"),
+    "index.html": ("text/html", "no-cache"),
+}
+
+# Compressors for text assets, in order of preference
+STATIC_ENCODINGS = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+if brotli is not None:
+    STATIC_ENCODINGS = {"br": lambda data: brotli.compress(data, quality=11), **STATIC_ENCODINGS}
+
+
+def _load_static_cache() -> dict:
+    """
+    Read the cached assets once, precomputing their headers and, for text
+    assets, their compressed variants keyed by content coding.
+    """
+    cache = {}
+    for name, (media_type, cache_control) in STATIC_CACHED_ASSETS.items():
+        path = static_dir / name
+        if not path.is_file():
+            continue
+        content = path.read_bytes()
+        etag = hashlib.md5(content).hexdigest()
+        headers = {
+            "ETag": f'"{etag}"',
+            "Last-Modified": formatdate(path.stat().st_mtime, usegmt=True),
+            "Cache-Control": cache_control,
+        }
+        variants = {"identity": (content, headers)}
+        if media_type.startswith("text/"):
+            headers["Vary"] = "Accept-Encoding"
+            for encoding, compress in STATIC_ENCODINGS.items():
+                variants[encoding] = (compress(content), {
+                    **headers,
+                    "ETag": f'"{etag}-{encoding}"',
+                    "Content-Encoding": encoding,
+                })
+        cache[name] = {"media_type": media_type, "variants": variants}
+    return cache
+
+
+def _negotiate_encoding(accept_encoding: Optional[str], variants: dict) -> str:
+    """Pick the preferred content coding the client accepts, or identity."""
+    accepted = set()
+    for token in (accept_encoding or "").lower().split(","):
+        coding, _, params = token.partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(coding.strip())
+    for encoding in STATIC_ENCODINGS:
+        if encoding in variants and encoding in accepted:
+            return encoding
+    return "identity"
+
+
+def _cached_static_response(request: Request, name: str) -> Optional[Response]:
+    """Serve a cached asset (304 if the client copy is current); None if it does not exist."""
+    cache = getattr(app.state, "static_cache", None)
+    if cache is None:
+        cache = app.state.static_cache = _load_static_cache()
+    asset = cache.get(name)
+    if asset is None:
+        return None
+    variants = asset["variants"]
+    content, headers = variants[_negotiate_encoding(request.headers.get("accept-encoding"), variants)]
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=asset["media_type"], headers=headers)
+
 
 @app.get("/favicon.ico", include_in_schema=False)
-async def favicon():
+async def favicon(request: Request):
     """避免浏览器请求 /favicon.ico 时返回 404。"""
-    favicon_path = PROJECT_ROOT / "static" / "favicon.ico"
-    if favicon_path.exists():
-        return FileResponse(favicon_path, media_type="image/x-icon")
-    return Response(status_code=204)
+    return _cached_static_response(request, "favicon.ico") or Response(status_code=204)
 
 
 @app.get("/robots.txt", include_in_schema=False)
-async def robots():
+async def robots(request: Request):
     """避免爬虫/浏览器请求 /robots.txt 时返回 404。"""
-    robots_path = PROJECT_ROOT / "static" / "robots.txt"
-    if robots_path.exists():
-        return FileResponse(robots_path, media_type="text/plain")
-    return Response(status_code=204)
+    return _cached_static_response(request, "robots.txt") or Response(status_code=204)
 
 
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Serve the student-friendly frontend."""
-    index_file = PROJECT_ROOT / "static" / "index.html"
-    if index_file.exists():
-        return FileResponse(index_file)
-    return {
-        "name": "PhysiTutor-AI",
-        "version": "0.1.0",
-        "description": "AI-native 引导型物理导师 MVP",
-        "frontend": "访问 /static/index.html 使用学生界面",
-        "docs": "/docs"
-    }
+    response = _cached_static_response(request, "index.html")
+    if response is not None:
+        return response
+    return ROOT_INFO
 
 
 @app.get("/api")
 async def api_info():
     """API information endpoint."""
-    return {
-        "name": "PhysiTutor-AI API",
-        "version": "0.1.0",
-        "docs": "/docs",
-        "endpoints": {
-            "session": {
-                "list_questions": "GET /session/",
-                "start": "POST /session/start",
-                "get": "GET /session/{session_id}",
-                "end": "POST /session/{session_id}/end"
-            },
-            "dialogue": {
-                "current_step": "GET /dialogue/{session_id}/current",
-                "submit_choice": "POST /dialogue/{session_id}/submit",
-                "history": "GET /dialogue/{session_id}/history",
-                "transfer": "POST /dialogue/{session_id}/transfer"
-            }
-        }
-    }
+    return API_INFO
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {
-        "status": "healthy",
-        "env": settings.app_env,
-        "gemini_configured": bool(settings.gemini_api_key),
-        "prompt_version": settings.prompt_version
-    }
+    return HEALTH_PAYLOAD
 
 
 @app.get("/logs/recent")
@@ -134,28 +293,3 @@ async def get_recent_logs(limit: int = 20):
         "count": len(logs),
         "logs": logs
     }
-
-
-# Startup event
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup."""
-    from app.models.database import init_db
-    
-    print("=" * 50)
-    print("PhysiTutor-AI MVP Starting...")
-    print(f"Environment: {settings.app_env}")
-    print(f"Prompt Version: {settings.prompt_version}")
-    print(f"Gemini API: {'Configured' if settings.gemini_api_key else 'Not Configured'}")
-    
-    # Initialize database
-    print("Initializing database...")
-    init_db()
-    print("✓ Database initialized")
-    
-    print(f"Frontend: http://localhost:8000/")
-    print(f"API Docs: http://localhost:8000/docs")
-    print("=" * 50)
-
-# Force reload
-# Question list updated
@@ -2,13 +2,17 @@
 Database models for PhysiTutor-AI
 """
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event, exc, Column, Integer, String, Boolean, DateTime, ForeignKey, Index, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.sql import func
 from config.settings import settings
 
 Base = declarative_base()
 
+# created_at keeps a Python-side default as well: create_all never alters
+# existing tables, so columns from an older physitutor.db have no DB default.
+
 
 class User(Base):
     """用户表"""
@@ -16,7 +20,7 @@ class User(Base):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String(50), unique=True, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
     
     # Relationships
     sessions = relationship("Session", back_populates="user")
@@ -26,6 +30,9 @@ class User(Base):
 class Session(Base):
     """会话表"""
     __tablename__ = 'sessions'
+    __table_args__ = (
+        Index('ix_sessions_user_status', 'user_id', 'status'),
+    )
     
     id = Column(String(36), primary_key=True)  # session_id
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # 允许匿名用户
@@ -34,7 +41,7 @@ class Session(Base):
     current_step_id = Column(Integer, default=1)
     correct_count = Column(Integer, default=0)
     retry_count = Column(Integer, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
     completed_at = Column(DateTime, nullable=True)
     
     # Relationships
@@ -45,6 +52,9 @@ class Session(Base):
 class StepRecord(Base):
     """步骤记录表"""
     __tablename__ = 'step_records'
+    __table_args__ = (
+        Index('ix_step_records_session_step', 'session_id', 'step_id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     session_id = Column(String(36), ForeignKey('sessions.id'), nullable=False)
@@ -52,7 +62,7 @@ class StepRecord(Base):
     student_choice = Column(String(10), nullable=False)
     is_correct = Column(Boolean, nullable=False)
     response_time_ms = Column(Integer, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
     
     # Relationships
     session = relationship("Session", back_populates="step_records")
@@ -61,6 +71,10 @@ class StepRecord(Base):
 class Mistake(Base):
     """错题本表"""
     __tablename__ = 'mistakes'
+    __table_args__ = (
+        # 同一用户在同一步骤上的同一个错误选项只记一次
+        Index('uq_mistakes_user_question_step_choice', 'user_id', 'question_id', 'step_id', 'wrong_choice', unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
@@ -68,7 +82,7 @@ class Mistake(Base):
     step_id = Column(Integer, nullable=False)
     wrong_choice = Column(String(10), nullable=False)
     correct_choice = Column(String(10), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
     
     # Relationships
     user = relationship("User", back_populates="mistakes")
@@ -81,26 +95,70 @@ class GeneratedQuestion(Base):
     id = Column(String(100), primary_key=True)
     source_question_id = Column(String(100), nullable=False)
     content = Column(Text, nullable=False)  # JSON 格式存储
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
 
 
 # Database initialization
+DATABASE_URL = f"sqlite:///{settings.PROJECT_ROOT}/physitutor.db"
+
+# Built once at import so every request reuses the same pool and dialect
+# instead of re-creating the engine per DB touch.
+_ENGINE = create_engine(
+    DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    # Reuse the most recently returned connection so a few stay warm and the
+    # rest can idle out instead of being cycled round-robin.
+    pool_use_lifo=True,
+    pool_recycle=3600,
+    connect_args={"check_same_thread": False},
+    echo=False,
+)
+_SessionLocal = sessionmaker(bind=_ENGINE, autoflush=False, expire_on_commit=False)
+
+
+@event.listens_for(_ENGINE, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+    """WAL lets readers run alongside the writer; NORMAL sync skips the fsync per commit."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+
 def get_engine():
     """Get database engine"""
-    database_url = f"sqlite:///{settings.PROJECT_ROOT}/physitutor.db"
-    engine = create_engine(database_url, echo=False)
-    return engine
+    return _ENGINE
 
 
 def init_db():
     """Initialize database tables"""
-    engine = get_engine()
-    Base.metadata.create_all(engine)
-    return engine
+    Base.metadata.create_all(_ENGINE)
+    # create_all skips tables that already exist, so add any indexes that
+    # were introduced after an older physitutor.db was created.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(_ENGINE, checkfirst=True)
+            except exc.IntegrityError as e:
+                # e.g. a unique index over rows that already hold duplicates
+                print(f"Could not create index {index.name}: {e.orig}")
+    return _ENGINE
 
 
 def get_db_session():
     """Get database session"""
-    engine = get_engine()
-    SessionLocal = sessionmaker(bind=engine)
-    return SessionLocal()
+    return _SessionLocal()
+
+
+def get_db():
+    """FastAPI dependency: yield a pooled session scoped to one request."""
+    db = _SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
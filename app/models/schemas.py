@@ -2,9 +2,18 @@
 PhysiTutor-AI Data Models (Pydantic Schemas)
 """
 from datetime import datetime
-from typing import Optional, List, Literal
-from pydantic import BaseModel, Field
-import uuid
+from typing import Any, Dict, FrozenSet, Optional, List, Literal
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+import secrets
+
+
+def _new_session_id() -> str:
+    """Short random session id, e.g. sess_1a2b3c4d."""
+    return "sess_" + secrets.token_hex(4)
+
+
+# Response models are built once per request and never mutated afterwards.
+_RESPONSE_CONFIG = ConfigDict(frozen=True, extra="ignore")
 
 
 # ============ Session Models ============
@@ -17,6 +26,8 @@ class SessionCreate(BaseModel):
 
 class SessionResponse(BaseModel):
     """Response model for session information."""
+    model_config = _RESPONSE_CONFIG
+    
     session_id: str
     question_id: str
     current_step_id: int
@@ -26,13 +37,14 @@ class SessionResponse(BaseModel):
 
 class SessionState(BaseModel):
     """Internal session state model."""
-    session_id: str = Field(default_factory=lambda: f"sess_{uuid.uuid4().hex[:8]}")
+    session_id: str = Field(default_factory=_new_session_id)
     question_id: str
     current_step_id: int = 1
     # Status reasoning means waiting for student reasoning or handling reasoning interaction
     status: Literal["active", "reasoning", "completed", "transfer_mode"] = "active"
     created_at: datetime = Field(default_factory=datetime.now)
     student_id: Optional[str] = None
+    user_id: Optional[int] = None  # DB user id, resolved once at session creation
     retry_count: int = 0  # Track retries for current step
     correct_count: int = 0  # Track correct answers
     total_steps: int = 0
@@ -55,6 +67,30 @@ class QuestionStep(BaseModel):
     correct: str
     feedback: FeedbackConfig
     
+    # Option letters (A, B, C, D) and the answer, normalized once instead of on every submission
+    _valid_choices: List[str] = PrivateAttr(default_factory=list)
+    _valid_choice_set: FrozenSet[str] = PrivateAttr(default=frozenset())
+    _correct_upper: str = PrivateAttr(default="")
+    
+    def model_post_init(self, __context: Any) -> None:
+        self._valid_choices = [opt[0] for opt in self.options]
+        self._valid_choice_set = frozenset(choice.upper() for choice in self._valid_choices)
+        self._correct_upper = self.correct.upper()
+    
+    @property
+    def valid_choices(self) -> List[str]:
+        """Option letters a student may submit for this step."""
+        return self._valid_choices
+    
+    def is_valid_choice(self, choice: str) -> bool:
+        """Check an upper-cased choice letter against this step's options."""
+        return choice in self._valid_choice_set
+    
+    def is_correct_choice(self, choice: str) -> bool:
+        """Check an upper-cased choice letter against this step's answer."""
+        return choice == self._correct_upper
+    
+
 class QuestionContext(BaseModel):
     """Context information for a question."""
     description: str
@@ -70,12 +106,23 @@ class Question(BaseModel):
     question_context: QuestionContext
     guided_steps: List[QuestionStep]
     next_similar_question_id: Optional[str] = None
+    
+    _step_by_id: Dict[int, QuestionStep] = PrivateAttr(default_factory=dict)
+    
+    def model_post_init(self, __context: Any) -> None:
+        self._step_by_id = {step.step_id: step for step in self.guided_steps}
+    
+    def get_step(self, step_id: int) -> Optional[QuestionStep]:
+        """Look up a guided step by its step_id."""
+        return self._step_by_id.get(step_id)
 
 
 # ============ Dialogue Models ============
 
 class CurrentStepResponse(BaseModel):
     """Response for current step endpoint."""
+    model_config = _RESPONSE_CONFIG
+    
     session_id: str
     question_id: str
     step_id: int
@@ -96,6 +143,8 @@ class ChoiceSubmit(BaseModel):
 
 class FeedbackResponse(BaseModel):
     """Response after submitting a choice."""
+    model_config = _RESPONSE_CONFIG
+    
     session_id: str
     step_id: int
     is_correct: bool
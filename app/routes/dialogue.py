@@ -2,8 +2,13 @@
 PhysiTutor-AI Dialogue Routes
 Handles the step-by-step guided dialogue interactions.
 """
-from fastapi import APIRouter, HTTPException
+from operator import attrgetter
 
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session as DBSession
+
+from app.models.database import get_db
 from app.models.schemas import (
     CurrentStepResponse,
     ChoiceSubmit,
@@ -15,6 +20,11 @@ from app.services.dialogue_manager import dialogue_manager
 
 router = APIRouter(prefix="/dialogue", tags=["Dialogue"])
 
+# Fields of a DialogueLog exposed in the history, fetched in one call per row
+_HISTORY_FIELDS = attrgetter(
+    "step_id", "student_choice", "expected_choice", "is_correct", "ai_feedback", "timestamp"
+)
+
 
 @router.get("/{session_id}/current", response_model=CurrentStepResponse)
 async def get_current_step(session_id: str):
@@ -38,7 +48,7 @@ async def get_current_step(session_id: str):
 
 
 @router.post("/{session_id}/submit", response_model=FeedbackResponse)
-async def submit_choice(session_id: str, request: ChoiceSubmit):
+async def submit_choice(session_id: str, request: ChoiceSubmit, db: DBSession = Depends(get_db)):
     """
     Submit a choice for the current step.
     
@@ -56,7 +66,7 @@ async def submit_choice(session_id: str, request: ChoiceSubmit):
     - **enter_transfer_mode**: Whether entering transfer verification mode
     """
     try:
-        return dialogue_manager.submit_choice(session_id, request.choice)
+        return await dialogue_manager.submit_choice(session_id, request.choice, db=db)
     except ValueError as e:
         # Determine appropriate status code
         error_msg = str(e)
@@ -90,14 +100,14 @@ async def get_dialogue_history(session_id: str):
         "status": session.status,
         "history": [
             {
-                "step_id": log.step_id,
-                "choice": log.student_choice,
-                "expected": log.expected_choice,
-                "is_correct": log.is_correct,
-                "feedback": log.ai_feedback,
-                "timestamp": log.timestamp.isoformat()
+                "step_id": step_id,
+                "choice": choice,
+                "expected": expected,
+                "is_correct": is_correct,
+                "feedback": feedback,
+                "timestamp": timestamp
             }
-            for log in logs
+            for step_id, choice, expected, is_correct, feedback, timestamp in map(_HISTORY_FIELDS, logs)
         ]
     }
 
@@ -113,7 +123,7 @@ async def start_transfer(session_id: str):
     """
     next_question = dialogue_manager.start_transfer_question(session_id)
     if not next_question:
-        next_question = dialogue_manager.start_transfer_question_with_ai(session_id)
+        next_question = await dialogue_manager.start_transfer_question_with_ai(session_id)
 
     if next_question:
         return {
@@ -129,7 +139,7 @@ async def start_transfer(session_id: str):
 
 
 @router.post("/{session_id}/reasoning", response_model=ReasoningFeedbackResponse)
-async def submit_reasoning(session_id: str, request: ReasoningSubmit):
+async def submit_reasoning(session_id: str, request: ReasoningSubmit, db: DBSession = Depends(get_db)):
     """
     Submit student's reasoning for evaluation.
     
@@ -142,6 +152,29 @@ async def submit_reasoning(session_id: str, request: ReasoningSubmit):
     Returns AI evaluation and standard solution.
     """
     try:
-        return dialogue_manager.submit_reasoning(session_id, request)
+        return await dialogue_manager.submit_reasoning(session_id, request, db=db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/{session_id}/reasoning/stream")
+async def stream_reasoning(session_id: str, request: ReasoningSubmit):
+    """
+    Streaming variant of /reasoning, as Server-Sent Events.
+    
+    - **session_id**: The session ID
+    - **text**: Student's reasoning
+    
+    Emits `delta` events ({"field": "evaluation" | "standard_solution",
+    "text": ...}) with plain text to append while the AI writes its reply,
+    then one `result` event with the same body as /reasoning.
+    """
+    try:
+        events = dialogue_manager.stream_reasoning(session_id, request)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
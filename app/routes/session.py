@@ -2,28 +2,24 @@
 PhysiTutor-AI Session Routes
 Handles session lifecycle management.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response
+from sqlalchemy.orm import Session as DBSession
 
-from app.models.schemas import SessionCreate, SessionResponse
+from app.models.database import get_db
 from app.models.schemas import SessionCreate, SessionResponse
 from app.services.dialogue_manager import dialogue_manager
-import shutil
+from app.utils.helpers import etag_matches
+import asyncio
 import uuid
-import os
-import base64
-import json
 from pathlib import Path
 from fastapi import UploadFile, File
-from app.services.llm_service import llm_service
-from app.services.db_service import db_service
-from app.models.schemas import Question
 from config.settings import settings
 
 router = APIRouter(prefix="/session", tags=["Session"])
 
 
 @router.post("/start", response_model=SessionResponse)
-async def start_session(request: SessionCreate):
+async def start_session(request: SessionCreate, db: DBSession = Depends(get_db)):
     """
     Start a new tutoring session.
     
@@ -33,9 +29,10 @@ async def start_session(request: SessionCreate):
     Returns the created session information including session_id.
     """
     try:
-        session = dialogue_manager.create_session(
+        session = await dialogue_manager.create_session(
             question_id=request.question_id,
-            student_id=request.student_id
+            student_id=request.student_id,
+            db=db
         )
         
         return SessionResponse(
@@ -70,7 +67,7 @@ async def get_session(session_id: str):
 
 
 @router.post("/{session_id}/end")
-async def end_session(session_id: str):
+async def end_session(session_id: str, db: DBSession = Depends(get_db)):
     """
     End a session and clean up resources.
     
@@ -78,7 +75,7 @@ async def end_session(session_id: str):
     
     Returns summary of the session.
     """
-    session = dialogue_manager.end_session(session_id)
+    session = await dialogue_manager.end_session(session_id, db=db)
     if not session:
         raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
     
@@ -94,12 +91,21 @@ async def end_session(session_id: str):
 
 
 @router.get("/")
-async def list_questions():
+async def list_questions(request: Request, response: Response):
     """
     List all available questions.
     
     Returns a list of questions with detailed information (id, topic, difficulty).
+    Answers 304 when the client's If-None-Match matches the current listing.
     """
+    headers = {
+        "ETag": dialogue_manager.get_questions_etag(),
+        "Cache-Control": "public, max-age=60, stale-while-revalidate=300",
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    
     questions = dialogue_manager.get_available_questions_with_info()
     return {
         "available_questions": questions,
@@ -108,13 +114,20 @@ async def list_questions():
 
 
 @router.post("/analyze-image")
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """
     Receive an image, analyze it using AI, and generate a new Question.
     Returns the new question_id.
     """
+    # Only this endpoint needs these; importing here keeps route registration light
+    import base64
+    import orjson
+    from app.models.schemas import Question
+    from app.services.db_service import db_service
+    from app.services.llm_service import llm_service
+    
     # Ensure upload directory exists
-    upload_dir = settings.PROJECT_ROOT / "static" / "uploads"
+    upload_dir = settings.uploads_dir
     if not upload_dir.exists():
         upload_dir.mkdir(parents=True, exist_ok=True)
     
@@ -125,25 +138,23 @@ async def analyze_image(file: UploadFile = File(...)):
     unique_filename = f"upload_{uuid.uuid4().hex}{file_ext}"
     file_path = upload_dir / unique_filename
     
-    # Save file
+    # Read the upload once; the same bytes feed both the disk write and the AI call
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        data = await file.read()
     finally:
-        file.file.close()
+        await file.close()
+    image_base64 = base64.b64encode(data).decode("ascii")
+    
+    mime_type = file.content_type or ""
+    if not mime_type.startswith("image/"):
+        mime_type = "image/jpeg" if file_ext.lower() in [".jpg", ".jpeg"] else "image/png"
 
-    # Read file for AI analysis
     try:
-        with open(file_path, "rb") as f:
-            image_data = f.read()
-            image_base64 = base64.b64encode(image_data).decode("utf-8")
-            
-        mime_type = "image/png"
-        if file_ext.lower() in [".jpg", ".jpeg"]:
-            mime_type = "image/jpeg"
-            
-        # Call LLM service
-        question_data = llm_service.analyze_physics_image(image_base64, mime_type)
+        # Save file and call LLM service concurrently
+        _, question_data = await asyncio.gather(
+            asyncio.to_thread(file_path.write_bytes, data),
+            llm_service.a_analyze_physics_image(image_base64, mime_type),
+        )
         
         if not question_data:
             raise HTTPException(status_code=400, detail="Failed to analyze image. Please try again with a clearer image.")
@@ -151,7 +162,7 @@ async def analyze_image(file: UploadFile = File(...)):
         # Assign ID and Image Path
         new_id = f"photo_{uuid.uuid4().hex[:8]}"
         # Ensure ID is unique
-        if new_id in dialogue_manager.questions:
+        if dialogue_manager.has_question(new_id):
              new_id = f"photo_{uuid.uuid4().hex[:8]}"
 
         question_data["id"] = new_id
@@ -170,9 +181,10 @@ async def analyze_image(file: UploadFile = File(...)):
         # Register to Memory
         dialogue_manager.register_question(question)
         
-        # Persist to Database
-        json_content = json.dumps(question_data, ensure_ascii=False)
-        db_service.save_generated_question(
+        # Persist to Database after the response is sent (the question is already served from memory)
+        json_content = orjson.dumps(question_data).decode("utf-8")
+        background_tasks.add_task(
+            db_service.save_generated_question,
             question_id=new_id,
             source_question_id="user_upload",
             content=json_content
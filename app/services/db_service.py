@@ -1,9 +1,13 @@
 """
 Database service for managing sessions, records, and user data.
 """
-from datetime import datetime
-from typing import Optional, List
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, List
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session as DBSession
+from sqlalchemy.sql import func
 from app.models.database import (
     get_db_session,
     User, Session, StepRecord, Mistake, GeneratedQuestion
@@ -14,24 +18,51 @@ from app.models.schemas import SessionState
 class DatabaseService:
     """Handle all database operations for the dialogue manager."""
     
-    def get_or_create_user(self, username: str = "anonymous") -> User:
-        """Get or create a user by username."""
+    def __init__(self):
+        # username -> user id; a user's id never changes once the row exists
+        self._user_id_cache = lru_cache(maxsize=1024)(self._lookup_user_id)
+        # Generated questions are write-once, so keep them after the first save/read
+        self._gen_q_cache: Dict[str, GeneratedQuestion] = {}
+    
+    @contextmanager
+    def _session_scope(self, db: Optional[DBSession] = None) -> Iterator[DBSession]:
+        """Use the caller's request-scoped session, or open a pooled one and close it after."""
+        if db is not None:
+            yield db
+            return
         db = get_db_session()
         try:
-            user = db.query(User).filter(User.username == username).first()
+            yield db
+        finally:
+            db.close()
+    
+    def get_or_create_user(self, username: str = "anonymous", db: Optional[DBSession] = None) -> User:
+        """Get or create a user by username."""
+        with self._session_scope(db) as db:
+            user = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
             if not user:
                 user = User(username=username)
                 db.add(user)
                 db.commit()
                 db.refresh(user)
             return user
-        finally:
-            db.close()
     
-    def create_session(self, session_state: SessionState, user_id: Optional[int] = None) -> Session:
+    def _lookup_user_id(self, username: str) -> int:
+        """Resolve a username to its id, creating the user if needed."""
+        return self.get_or_create_user(username).id
+    
+    def get_or_create_user_id(self, username: str = "anonymous") -> int:
+        """Get or create a user by username, returning only the (cached) id."""
+        return self._user_id_cache(username)
+    
+    def create_session(
+        self,
+        session_state: SessionState,
+        user_id: Optional[int] = None,
+        db: Optional[DBSession] = None
+    ) -> Session:
         """Create a new session in the database."""
-        db = get_db_session()
-        try:
+        with self._session_scope(db) as db:
             db_session = Session(
                 id=session_state.session_id,
                 user_id=user_id,
@@ -44,32 +75,35 @@ class DatabaseService:
             db.add(db_session)
             db.commit()
             return db_session
-        finally:
-            db.close()
     
-    def get_session(self, session_id: str) -> Optional[Session]:
+    def get_session(self, session_id: str, db: Optional[DBSession] = None) -> Optional[Session]:
         """Get a session from the database."""
-        db = get_db_session()
-        try:
-            return db.query(Session).filter(Session.id == session_id).first()
-        finally:
-            db.close()
+        with self._session_scope(db) as db:
+            return db.get(Session, session_id)
     
-    def update_session(self, session_state: SessionState) -> None:
-        """Update an existing session in the database."""
-        db = get_db_session()
-        try:
-            db_session = db.query(Session).filter(Session.id == session_state.session_id).first()
-            if db_session:
-                db_session.status = session_state.status
-                db_session.current_step_id = session_state.current_step_id
-                db_session.correct_count = session_state.correct_count
-                db_session.retry_count = session_state.retry_count
-                if session_state.status == "completed":
-                    db_session.completed_at = datetime.utcnow()
-                db.commit()
-        finally:
-            db.close()
+    def update_session(self, session_state: SessionState, db: Optional[DBSession] = None) -> None:
+        """Update an existing session in the database (no-op if the row is missing)."""
+        with self._session_scope(db) as db:
+            db.execute(
+                update(Session)
+                .where(Session.id == session_state.session_id)
+                .values(self._session_progress_values(session_state))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+    
+    @staticmethod
+    def _session_progress_values(session_state: SessionState) -> dict:
+        """Column values for a single UPDATE of a session's progress."""
+        values = {
+            Session.status: session_state.status,
+            Session.current_step_id: session_state.current_step_id,
+            Session.correct_count: session_state.correct_count,
+            Session.retry_count: session_state.retry_count,
+        }
+        if session_state.status == "completed":
+            values[Session.completed_at] = func.now()
+        return values
     
     def create_step_record(
         self,
@@ -77,11 +111,11 @@ class DatabaseService:
         step_id: int,
         student_choice: str,
         is_correct: bool,
-        response_time_ms: int
+        response_time_ms: int,
+        db: Optional[DBSession] = None
     ) -> StepRecord:
         """Create a step record in the database."""
-        db = get_db_session()
-        try:
+        with self._session_scope(db) as db:
             record = StepRecord(
                 session_id=session_id,
                 step_id=step_id,
@@ -92,8 +126,6 @@ class DatabaseService:
             db.add(record)
             db.commit()
             return record
-        finally:
-            db.close()
     
     def create_mistake(
         self,
@@ -101,36 +133,81 @@ class DatabaseService:
         question_id: str,
         step_id: int,
         wrong_choice: str,
-        correct_choice: str
-    ) -> Mistake:
-        """Add a mistake to the mistake book."""
-        db = get_db_session()
-        try:
-            mistake = Mistake(
+        correct_choice: str,
+        db: Optional[DBSession] = None
+    ) -> None:
+        """Add a mistake to the mistake book (a repeat of the same wrong choice is ignored)."""
+        with self._session_scope(db) as db:
+            db.execute(self._insert_mistake(
                 user_id=user_id,
                 question_id=question_id,
                 step_id=step_id,
                 wrong_choice=wrong_choice,
                 correct_choice=correct_choice
+            ))
+            db.commit()
+    
+    @staticmethod
+    def _insert_mistake(**values):
+        """INSERT ... ON CONFLICT DO NOTHING against the mistake-book unique index.
+        
+        No conflict target is named, so the statement still works on an older
+        database where the unique index could not be created.
+        """
+        return sqlite_insert(Mistake).values(**values).on_conflict_do_nothing()
+    
+    def record_submission(
+        self,
+        session_state: SessionState,
+        step_id: int,
+        student_choice: str,
+        is_correct: bool,
+        response_time_ms: int,
+        correct_choice: str,
+        db: Optional[DBSession] = None
+    ) -> None:
+        """Write a choice submission (step record, mistake, session progress) in one commit."""
+        with self._session_scope(db) as db:
+            db.add(StepRecord(
+                session_id=session_state.session_id,
+                step_id=step_id,
+                student_choice=student_choice,
+                is_correct=is_correct,
+                response_time_ms=response_time_ms
+            ))
+            
+            # If incorrect, add to mistake book for known users
+            if not is_correct and session_state.user_id:
+                db.execute(self._insert_mistake(
+                    user_id=session_state.user_id,
+                    question_id=session_state.question_id,
+                    step_id=step_id,
+                    wrong_choice=student_choice,
+                    correct_choice=correct_choice
+                ))
+            
+            db.execute(
+                update(Session)
+                .where(Session.id == session_state.session_id)
+                .values(self._session_progress_values(session_state))
+                .execution_options(synchronize_session=False)
             )
-            db.add(mistake)
             db.commit()
-            return mistake
-        finally:
-            db.close()
     
-    def get_user_mistakes(self, user_id: int) -> List[Mistake]:
+    def get_user_mistakes(self, user_id: int, db: Optional[DBSession] = None) -> List[Mistake]:
         """Get all mistakes for a user."""
-        db = get_db_session()
-        try:
-            return db.query(Mistake).filter(Mistake.user_id == user_id).all()
-        finally:
-            db.close()
+        with self._session_scope(db) as db:
+            return db.scalars(select(Mistake).where(Mistake.user_id == user_id)).all()
     
-    def save_generated_question(self, question_id: str, source_question_id: str, content: str) -> GeneratedQuestion:
+    def save_generated_question(
+        self,
+        question_id: str,
+        source_question_id: str,
+        content: str,
+        db: Optional[DBSession] = None
+    ) -> GeneratedQuestion:
         """Save an AI-generated question to the database."""
-        db = get_db_session()
-        try:
+        with self._session_scope(db) as db:
             gen_question = GeneratedQuestion(
                 id=question_id,
                 source_question_id=source_question_id,
@@ -138,17 +215,20 @@ class DatabaseService:
             )
             db.add(gen_question)
             db.commit()
+            self._gen_q_cache[question_id] = gen_question
             return gen_question
-        finally:
-            db.close()
     
-    def get_generated_question(self, question_id: str) -> Optional[GeneratedQuestion]:
+    def get_generated_question(self, question_id: str, db: Optional[DBSession] = None) -> Optional[GeneratedQuestion]:
         """Get a generated question from the database."""
-        db = get_db_session()
-        try:
-            return db.query(GeneratedQuestion).filter(GeneratedQuestion.id == question_id).first()
-        finally:
-            db.close()
+        cached = self._gen_q_cache.get(question_id)
+        if cached is not None:
+            return cached
+        with self._session_scope(db) as db:
+            gen_question = db.get(GeneratedQuestion, question_id)
+            if gen_question is not None:
+                db.expunge(gen_question)
+                self._gen_q_cache[question_id] = gen_question
+            return gen_question
 
 
 # Global database service instance
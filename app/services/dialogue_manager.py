@@ -2,12 +2,18 @@
 PhysiTutor-AI Dialogue Manager
 Controls the step-by-step guided dialogue flow.
 """
+import asyncio
 import base64
+import hashlib
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import orjson
+from sqlalchemy.orm import Session as DBSession
 
 from app.models.schemas import (
     SessionState,
@@ -23,6 +29,7 @@ from app.models.schemas import (
 from app.services.logger import dialogue_logger
 from app.services.llm_service import llm_service
 from app.services.db_service import db_service
+from app.utils.helpers import sse_event
 from config.settings import settings
 
 
@@ -41,54 +48,128 @@ class DialogueManager:
     def __init__(self):
         """Initialize the dialogue manager."""
         self.sessions: Dict[str, SessionState] = {}
-        self.questions: Dict[str, Question] = {}
-        self._load_questions()
+        # Slim metadata per question (enough for listings and transfer lookups);
+        # built by load_questions() at app startup, or on first use
+        self._question_index: Optional[Dict[str, dict]] = None
+        # Source files of indexed questions, parsed in full only on first use
+        self._question_files: Dict[str, Path] = {}
+        self._questions_full: Dict[str, Question] = {}
+        # Question listing and its ETag, recomputed after the index changes
+        self._info_cache: Optional[list] = None
+        self._questions_etag: Optional[str] = None
+        # image path -> (base64, mime type) sent with AI transfer requests
+        self._image_b64_cache: Dict[str, Tuple[str, str]] = {}
+    
+    @property
+    def _index(self) -> Dict[str, dict]:
+        """The question metadata index, loading it if startup has not yet."""
+        if self._question_index is None:
+            self.load_questions()
+        return self._question_index
     
-    def _load_questions(self) -> None:
-        """Load all questions from the data directory."""
+    def load_questions(self) -> None:
+        """Index all questions from the data directory (full parsing is deferred)."""
+        question_index: Dict[str, dict] = {}
         questions_dir = settings.questions_dir
         
         # Also check practice directory for existing questions
         practice_dir = Path(settings.PROJECT_ROOT) / "practice"
         
-        for directory in [questions_dir, practice_dir]:
-            if not directory.exists():
-                continue
-            
-            for file_path in directory.glob("*.json"):
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        question = Question(**data)
-                        self.questions[question.id] = question
-                except Exception as e:
-                    print(f"Error loading question from {file_path}: {e}")
+        file_paths = [
+            file_path
+            for directory in [questions_dir, practice_dir]
+            if directory.exists()
+            for file_path in directory.glob("*.json")
+        ]
+        
+        # Reads are I/O-bound, so overlap them; results come back in file order
+        if file_paths:
+            with ThreadPoolExecutor(max_workers=min(32, len(file_paths))) as executor:
+                for file_path, entry in zip(file_paths, executor.map(self._read_index_entry, file_paths)):
+                    if entry is not None:
+                        question_index[entry["id"]] = entry
+                        self._question_files[entry["id"]] = file_path
+        
+        if self._question_index:
+            # Keep questions registered at runtime (e.g. AI-generated ones)
+            question_index = {**self._question_index, **question_index}
+        self._question_index = question_index
+        self._questions_etag = None
+        self._info_cache = None
+    
+    @classmethod
+    def _read_index_entry(cls, file_path: Path) -> Optional[dict]:
+        """Read one question file and return its index entry, or None if unreadable."""
+        try:
+            with open(file_path, "rb") as f:
+                return cls._index_entry(orjson.loads(f.read()))
+        except Exception as e:
+            print(f"Error loading question from {file_path}: {e}")
+            return None
+    
+    @staticmethod
+    def _index_entry(data: dict) -> dict:
+        """Build the metadata index entry for a question dict."""
+        return {
+            "id": data["id"],
+            "topic": data["topic"],
+            "difficulty": data["difficulty"],
+            "image": data.get("image"),
+            "next_similar_question_id": data.get("next_similar_question_id"),
+        }
+    
+    def _load_full(self, question_id: str) -> Question:
+        """Get the full question, parsing and validating its file on first use."""
+        question = self._questions_full.get(question_id)
+        if question is None:
+            with open(self._question_files[question_id], "rb") as f:
+                question = Question(**orjson.loads(f.read()))
+            self._questions_full[question_id] = question
+        return question
+    
+    def has_question(self, question_id: str) -> bool:
+        """Check whether a question ID is known."""
+        return question_id in self._index
+    
+    def get_question(self, question_id: str) -> Optional[Question]:
+        """Get the full question by ID."""
+        if question_id not in self._index:
+            return None
+        return self._load_full(question_id)
     
     def get_available_questions(self) -> list:
         """Get list of available question IDs."""
-        return list(self.questions.keys())
+        return list(self._index.keys())
     
     def get_available_questions_with_info(self) -> list:
         """Get list of available questions with detailed information."""
-        result = []
-        # Sort by question ID to ensure consistent ordering
-        for question_id in sorted(self.questions.keys()):
-            question = self.questions[question_id]
-            result.append({
-                "id": question.id,
-                "topic": question.topic,
-                "difficulty": question.difficulty
-            })
-        return result
+        if self._info_cache is None:
+            # Sort by question ID to ensure consistent ordering
+            self._info_cache = [
+                {"id": entry["id"], "topic": entry["topic"], "difficulty": entry["difficulty"]}
+                for _, entry in sorted(self._index.items())
+            ]
+        return self._info_cache
+    
+    def get_questions_etag(self) -> str:
+        """Get the ETag of the question listing."""
+        if self._questions_etag is None:
+            listing = json.dumps(self.get_available_questions_with_info(), sort_keys=True)
+            self._questions_etag = f'"{hashlib.md5(listing.encode()).hexdigest()}"'
+        return self._questions_etag
 
     def register_question(self, question: Question) -> None:
         """注册一道题目到内存（如 AI 生成的类似题）。"""
-        self.questions[question.id] = question
+        self._questions_full[question.id] = question
+        self._index[question.id] = self._index_entry(question.model_dump())
+        self._questions_etag = None
+        self._info_cache = None
 
-    def create_session(
+    async def create_session(
         self,
         question_id: str,
-        student_id: Optional[str] = None
+        student_id: Optional[str] = None,
+        db: Optional[DBSession] = None
     ) -> SessionState:
         """
         Create a new tutoring session.
@@ -96,6 +177,7 @@ class DialogueManager:
         Args:
             question_id: ID of the question to use
             student_id: Optional student identifier
+            db: Optional request-scoped DB session
             
         Returns:
             The created session state
@@ -103,10 +185,10 @@ class DialogueManager:
         Raises:
             ValueError: If question_id is not found
         """
-        if question_id not in self.questions:
+        if question_id not in self._index:
             raise ValueError(f"Question '{question_id}' not found")
         
-        question = self.questions[question_id]
+        question = self._load_full(question_id)
         
         session = SessionState(
             question_id=question_id,
@@ -118,10 +200,10 @@ class DialogueManager:
         self.sessions[session.session_id] = session
         
         # Persist to database  # Get or create anonymous user if needed
-        user = None
+        # DB work runs in a worker thread so the event loop keeps serving requests
         if student_id:
-            user = db_service.get_or_create_user(student_id)
-        db_service.create_session(session, user.id if user else None)
+            session.user_id = await asyncio.to_thread(db_service.get_or_create_user_id, student_id)
+        await asyncio.to_thread(db_service.create_session, session, session.user_id, db=db)
         
         return session
     
@@ -151,14 +233,10 @@ class DialogueManager:
         if session.status == "completed":
             raise ValueError("Session already completed")
         
-        question = self.questions[session.question_id]
+        question = self._load_full(session.question_id)
         
         # Find current step
-        current_step = None
-        for step in question.guided_steps:
-            if step.step_id == session.current_step_id:
-                current_step = step
-                break
+        current_step = question.get_step(session.current_step_id)
         
         if not current_step:
             raise ValueError(f"Step {session.current_step_id} not found")
@@ -186,10 +264,11 @@ class DialogueManager:
             is_reasoning_mode=session.status == "reasoning"
         )
     
-    def submit_choice(
+    async def submit_choice(
         self,
         session_id: str,
-        choice: str
+        choice: str,
+        db: Optional[DBSession] = None
     ) -> FeedbackResponse:
         """
         Process a student's choice submission.
@@ -197,6 +276,7 @@ class DialogueManager:
         Args:
             session_id: The session ID
             choice: The student's choice (e.g., 'A', 'B', 'C', 'D')
+            db: Optional request-scoped DB session
             
         Returns:
             Feedback response with correctness and guidance
@@ -213,26 +293,21 @@ class DialogueManager:
         if session.status == "completed":
             raise ValueError("Session already completed")
         
-        question = self.questions[session.question_id]
+        question = self._load_full(session.question_id)
         
         # Find current step
-        current_step = None
-        for step in question.guided_steps:
-            if step.step_id == session.current_step_id:
-                current_step = step
-                break
+        current_step = question.get_step(session.current_step_id)
         
         if not current_step:
             raise ValueError(f"Step {session.current_step_id} not found")
         
         # Validate choice format
         choice = choice.upper().strip()
-        valid_choices = [opt[0] for opt in current_step.options]  # Extract A, B, C, D
-        if choice not in valid_choices:
-            raise ValueError(f"Invalid choice '{choice}'. Must be one of {valid_choices}")
+        if not current_step.is_valid_choice(choice):
+            raise ValueError(f"Invalid choice '{choice}'. Must be one of {current_step.valid_choices}")
         
         # Check correctness
-        is_correct = choice == current_step.correct
+        is_correct = current_step.is_correct_choice(choice)
         
         # Get appropriate feedback
         if is_correct:
@@ -246,7 +321,7 @@ class DialogueManager:
         ai_feedback = None
         if not is_correct and session.retry_count >= 2:
             # Use AI for additional guidance after multiple retries
-            ai_feedback = llm_service.generate_feedback(
+            ai_feedback = await llm_service.a_generate_feedback(
                 step_prompt=current_step.prompt,
                 student_choice=choice,
                 is_correct=is_correct,
@@ -256,28 +331,6 @@ class DialogueManager:
         # Calculate response time
         response_time_ms = int((time.time() - start_time) * 1000)
         
-        # Save step record to database
-        db_service.create_step_record(
-            session_id=session_id,
-            step_id=session.current_step_id,
-            student_choice=choice,
-            is_correct=is_correct,
-            response_time_ms=response_time_ms
-        )
-        
-        # If incorrect, add to mistake book
-        if not is_correct:
-            # Get user_id from session if available
-            db_session = db_service.get_session(session_id)
-            if db_session and db_session.user_id:
-                db_service.create_mistake(
-                    user_id=db_session.user_id,
-                    question_id=session.question_id,
-                    step_id=session.current_step_id,
-                    wrong_choice=choice,
-                    correct_choice=current_step.correct
-                )
-        
         # Log the interaction
         log_entry = DialogueLog(
             session_id=session_id,
@@ -310,8 +363,17 @@ class DialogueManager:
                 session.status = "reasoning"
                 # We don't log summary yet, wait until reasoning/transfer is done
         
-        # Update session in database
-        db_service.update_session(session)
+        # Persist step record, mistake and session progress in one transaction
+        await asyncio.to_thread(
+            db_service.record_submission,
+            session,
+            step_id=current_step.step_id,
+            student_choice=choice,
+            is_correct=is_correct,
+            response_time_ms=response_time_ms,
+            correct_choice=current_step.correct,
+            db=db
+        )
         
         return FeedbackResponse(
             session_id=session_id,
@@ -353,17 +415,39 @@ class DialogueManager:
         if not session or session.status != "transfer_mode":
             return None
         
-        question = self.questions[session.question_id]
-        next_question_id = question.next_similar_question_id
+        next_question_id = self._index[session.question_id]["next_similar_question_id"]
         
-        if next_question_id and next_question_id in self.questions:
+        if next_question_id and next_question_id in self._index:
             # Create new session for transfer question
             # (In a full implementation, this would link to the original session)
             return next_question_id
         
         return None
 
-    def start_transfer_question_with_ai(self, session_id: str) -> Optional[str]:
+    def _question_image_b64(self, question: Question) -> Tuple[str, str]:
+        """Return (base64 data, mime type) for a question's image, cached per image path."""
+        if not question.image:
+            return "", "image/png"
+        
+        cached = self._image_b64_cache.get(question.image)
+        if cached is not None:
+            return cached
+        
+        image_path = Path(settings.PROJECT_ROOT) / question.image.lstrip("/")
+        if not image_path.exists():
+            return "", "image/png"
+        try:
+            # base64 output is pure ASCII, so skip the UTF-8 decoder
+            image_base64 = base64.b64encode(image_path.read_bytes()).decode("ascii")
+        except Exception as e:
+            print(f"Error reading question image: {e}")
+            return "", "image/png"
+        mime_type = "image/png" if image_path.suffix.lower() == ".png" else "image/jpeg"
+        
+        self._image_b64_cache[question.image] = (image_base64, mime_type)
+        return image_base64, mime_type
+    
+    async def start_transfer_question_with_ai(self, session_id: str) -> Optional[str]:
         """
         用 Gemini 根据原题图片和题目信息生成一道思路类似的新题，并创建新会话。
         要求会话处于 transfer_mode 或 completed。
@@ -375,23 +459,13 @@ class DialogueManager:
         if not session or session.status not in ("transfer_mode", "completed"):
             return None
 
-        question = self.questions.get(session.question_id)
+        question = self.get_question(session.question_id)
         if not question:
             return None
 
-        image_base64 = ""
-        mime_type = "image/png"
-        if question.image:
-            image_path = Path(settings.PROJECT_ROOT) / question.image.lstrip("/")
-            if image_path.exists():
-                try:
-                    with open(image_path, "rb") as f:
-                        image_base64 = base64.b64encode(f.read()).decode()
-                    mime_type = "image/png" if image_path.suffix.lower() == ".png" else "image/jpeg"
-                except Exception as e:
-                    print(f"Error reading question image: {e}")
+        image_base64, mime_type = await asyncio.to_thread(self._question_image_b64, question)
 
-        data = llm_service.generate_similar_question(
+        data = await llm_service.a_generate_similar_question(
             question=question,
             image_base64=image_base64,
             mime_type=mime_type,
@@ -406,10 +480,11 @@ class DialogueManager:
         # 不在此处 create_session，由前端 startSession(next_question_id) 时创建
         return new_id
 
-    def submit_reasoning(
+    async def submit_reasoning(
         self,
         session_id: str,
-        reasoning: ReasoningSubmit
+        reasoning: ReasoningSubmit,
+        db: Optional[DBSession] = None
     ) -> ReasoningFeedbackResponse:
         """
         Process student's reasoning submission.
@@ -418,15 +493,58 @@ class DialogueManager:
         if not session:
             raise ValueError(f"Session '{session_id}' not found")
         
-        question = self.questions[session.question_id]
+        question = self._load_full(session.question_id)
         
         # Call LLM
-        result = llm_service.analyze_reasoning(
+        result = await llm_service.a_analyze_reasoning(
             question=question,
             student_reasoning=reasoning.text,
             student_image=reasoning.image
         )
+        return await self._complete_reasoning(session, question, result, db=db)
+
+    def stream_reasoning(
+        self,
+        session_id: str,
+        reasoning: ReasoningSubmit
+    ) -> AsyncIterator[bytes]:
+        """
+        Streaming variant of submit_reasoning, as Server-Sent Events.
+        
+        The session is checked up front (raising ValueError like submit_reasoning);
+        the returned stream then emits "delta" events with the evaluation and
+        solution text as it arrives, and ends with a "result" event carrying
+        the ReasoningFeedbackResponse.
+        """
+        session = self.sessions.get(session_id)
+        if not session:
+            raise ValueError(f"Session '{session_id}' not found")
         
+        question = self._load_full(session.question_id)
+        return self._reasoning_events(session, question, reasoning)
+
+    async def _reasoning_events(
+        self,
+        session: SessionState,
+        question: Question,
+        reasoning: ReasoningSubmit
+    ) -> AsyncIterator[bytes]:
+        async for item in llm_service.a_stream_reasoning(question, reasoning.text):
+            if "delta" in item:
+                yield sse_event("delta", item["delta"])
+            else:
+                # The request's DB session is closed once streaming starts, so persist on our own
+                response = await self._complete_reasoning(session, question, item["result"])
+                yield sse_event("result", response.model_dump())
+
+    async def _complete_reasoning(
+        self,
+        session: SessionState,
+        question: Question,
+        result: Dict[str, str],
+        db: Optional[DBSession] = None
+    ) -> ReasoningFeedbackResponse:
+        """Advance the session past the reasoning stage and build the response."""
         # Determine next state
         is_transfer_ready = True
         if session.status == "reasoning":
@@ -437,21 +555,22 @@ class DialogueManager:
                 self._log_session_summary(session)
         
         # Update session in database
-        db_service.update_session(session)
+        await asyncio.to_thread(db_service.update_session, session, db=db)
              
         return ReasoningFeedbackResponse(
-            session_id=session_id,
+            session_id=session.session_id,
             ai_evaluation=result.get("evaluation", ""),
             standard_solution=result.get("standard_solution", ""),
             is_transfer_ready=is_transfer_ready
         )
 
-    def end_session(self, session_id: str) -> Optional[SessionState]:
+    async def end_session(self, session_id: str, db: Optional[DBSession] = None) -> Optional[SessionState]:
         """
         End a session and clean up.
         
         Args:
             session_id: The session ID
+            db: Optional request-scoped DB session
             
         Returns:
             The final session state
@@ -463,7 +582,9 @@ class DialogueManager:
                 self._log_session_summary(session)
             
             # Update final state in database
-            db_service.update_session(session)
+            await asyncio.to_thread(db_service.update_session, session, db=db)
+            # Make this session's interaction lines durable before dropping it
+            await dialogue_logger.aflush()
             
             del self.sessions[session_id]
         return session
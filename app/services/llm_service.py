@@ -2,10 +2,26 @@
 PhysiTutor-AI Gemini API Service
 调用方式与 scripts/test_gemini.py 一致：REST API（requests），超时 120s。
 """
-import json
+import asyncio
+import atexit
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+import httpx
+import orjson
 import requests
 from requests.adapters import HTTPAdapter
-from typing import Optional, List, Dict, TYPE_CHECKING
+from typing import Any, AsyncIterator, Dict, Hashable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from app.models.schemas import Question
@@ -13,33 +29,191 @@ from urllib3.util.retry import Retry
 
 from zhipuai import ZhipuAI
 
+try:
+    from PIL import Image
+except ImportError:  # Optional: without Pillow, images are uploaded to the vision model as-is
+    Image = None
+
 from config.settings import settings, get_system_prompt
 
-# 与 test_gemini.py 一致的超时时间
-GEMINI_TIMEOUT = 120
+logger = logging.getLogger(__name__)
 
 
-def _call_gemini_rest(api_key: str, model: str, prompt: str, timeout: int = GEMINI_TIMEOUT) -> str:
+def _setup_logger() -> None:
     """
-    与 scripts/test_gemini.py 同方式：REST API 调用 Gemini generateContent。
+    Route this module's records through a QueueHandler: callers only enqueue,
+    and a QueueListener thread does the (possibly slow) stderr writes.
     """
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
-    headers = {"Content-Type": "application/json", "X-goog-api-key": api_key}
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    if logger.handlers:
+        return
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(settings.log_level.upper())
+    logger.propagate = False
 
+
+_setup_logger()
+
+# 与 test_gemini.py 一致的超时时间
+GEMINI_TIMEOUT = 120
+GEMINI_RETRY_TOTAL = 2
+GEMINI_RETRY_BACKOFF = 1
+GEMINI_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Startup warmup only needs the connection, so give up quickly
+WARMUP_TIMEOUT = 5
+
+def _build_gemini_session() -> requests.Session:
+    """HTTP session with retries and a connection pool, so calls reuse the TLS connection."""
     session = requests.Session()
     retry = Retry(
-        total=2,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
+        total=GEMINI_RETRY_TOTAL,
+        backoff_factor=GEMINI_RETRY_BACKOFF,
+        status_forcelist=list(GEMINI_RETRY_STATUSES),
         allowed_methods=["POST"],
     )
-    session.mount("https://", HTTPAdapter(max_retries=retry))
+    session.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=retry))
+    return session
+
+
+# Shared sync HTTP session for Gemini REST calls
+_GEMINI_SESSION = _build_gemini_session()
+
+# Shared async HTTP client, created on first use and closed at app shutdown
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Get (or lazily create) the shared async HTTP client."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=GEMINI_TIMEOUT,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _async_client
+
+
+async def aclose_async_client() -> None:
+    """Close the shared async HTTP client."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _gemini_url(model: str) -> str:
+    return f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+
+
+def _gemini_models_url() -> str:
+    return "https://generativelanguage.googleapis.com/v1beta/models"
+
+
+def _gemini_stream_url(model: str) -> str:
+    return f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse"
+
+
+def _gemini_headers(api_key: str) -> Dict[str, str]:
+    return {"Content-Type": "application/json", "X-goog-api-key": api_key}
+
+
+def _text_contents(prompt: str) -> List[Dict]:
+    return [{"parts": [{"text": prompt}]}]
+
+
+def _image_contents(prompt: str, image_base64: str, mime_type: str) -> List[Dict]:
+    return [
+        {
+            "parts": [
+                {"inlineData": {"mimeType": mime_type, "data": image_base64}},
+                {"text": prompt},
+            ]
+        }
+    ]
 
-    resp = session.post(url, headers=headers, json=payload, timeout=timeout)
+
+def _payload(
+    contents: List[Dict],
+    expect_json: bool = False,
+    system_instruction: Optional[str] = None,
+) -> Dict:
+    """
+    generateContent body. expect_json switches on Gemini's native JSON output
+    mode; system_instruction goes in its own field instead of the user turn.
+    """
+    payload = {"contents": contents}
+    if system_instruction:
+        payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    if expect_json:
+        payload["generationConfig"] = {"responseMimeType": "application/json"}
+    return payload
+
+
+def _response_text(result: Dict) -> str:
+    """First text part of a generateContent response."""
+    for part in result["candidates"][0]["content"]["parts"]:
+        if "text" in part:
+            return part["text"].strip()
+    return ""
+
+
+def _gemini_post(api_key: str, model: str, payload: Dict, timeout: int = GEMINI_TIMEOUT) -> Dict:
+    """POST a generateContent payload on the shared session (retries handled by its adapter)."""
+    resp = _GEMINI_SESSION.post(_gemini_url(model), headers=_gemini_headers(api_key), json=payload, timeout=timeout)
     resp.raise_for_status()
-    result = resp.json()
-    return result["candidates"][0]["content"]["parts"][0]["text"].strip()
+    return resp.json()
+
+
+async def _agemini_post(api_key: str, model: str, payload: Dict, timeout: int = GEMINI_TIMEOUT) -> Dict:
+    """_gemini_post 的异步版本：共享 httpx 客户端，重试策略与同步版一致。"""
+    client = _get_async_client()
+    url = _gemini_url(model)
+    headers = _gemini_headers(api_key)
+    for attempt in range(GEMINI_RETRY_TOTAL + 1):
+        if attempt:
+            await asyncio.sleep(GEMINI_RETRY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            resp = await client.post(url, headers=headers, json=payload, timeout=timeout)
+        except httpx.TransportError:
+            if attempt == GEMINI_RETRY_TOTAL:
+                raise
+            continue
+        if resp.status_code in GEMINI_RETRY_STATUSES and attempt < GEMINI_RETRY_TOTAL:
+            continue
+        resp.raise_for_status()
+        return resp.json()
+
+
+def _call_gemini_rest(
+    api_key: str,
+    model: str,
+    prompt: str,
+    timeout: int = GEMINI_TIMEOUT,
+    expect_json: bool = False,
+    system_instruction: Optional[str] = None,
+) -> str:
+    """
+    与 scripts/test_gemini.py 同方式：REST API 调用 Gemini generateContent。
+    """
+    payload = _payload(_text_contents(prompt), expect_json, system_instruction)
+    return _response_text(_gemini_post(api_key, model, payload, timeout))
+
+
+def _call_gemini_rest_contents(
+    api_key: str,
+    model: str,
+    contents: List[Dict],
+    timeout: int = GEMINI_TIMEOUT,
+    system_instruction: Optional[str] = None,
+) -> str:
+    """REST 调用 Gemini generateContent，contents 可为多轮对话（role: user / model）。"""
+    payload = _payload(contents, system_instruction=system_instruction)
+    return _response_text(_gemini_post(api_key, model, payload, timeout))
 
 
 def _call_gemini_rest_with_image(
@@ -49,38 +223,350 @@ def _call_gemini_rest_with_image(
     image_base64: str,
     mime_type: str = "image/png",
     timeout: int = GEMINI_TIMEOUT,
+    expect_json: bool = False,
 ) -> str:
     """REST 调用 Gemini generateContent，带图片（inline_data）。"""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
-    headers = {"Content-Type": "application/json", "X-goog-api-key": api_key}
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {"inlineData": {"mimeType": mime_type, "data": image_base64}},
-                    {"text": prompt},
-                ]
-            }
-        ]
-    }
+    payload = _payload(_image_contents(prompt, image_base64, mime_type), expect_json)
+    return _response_text(_gemini_post(api_key, model, payload, timeout))
 
-    session = requests.Session()
-    retry = Retry(
-        total=2,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["POST"],
-    )
-    session.mount("https://", HTTPAdapter(max_retries=retry))
 
-    resp = session.post(url, headers=headers, json=payload, timeout=timeout)
-    resp.raise_for_status()
-    result = resp.json()
-    parts = result["candidates"][0]["content"]["parts"]
-    for p in parts:
-        if "text" in p:
-            return p["text"].strip()
-    return ""
+async def _acall_gemini_rest(
+    api_key: str,
+    model: str,
+    prompt: str,
+    timeout: int = GEMINI_TIMEOUT,
+    expect_json: bool = False,
+    system_instruction: Optional[str] = None,
+) -> str:
+    """_call_gemini_rest 的异步版本（httpx）。"""
+    payload = _payload(_text_contents(prompt), expect_json, system_instruction)
+    return _response_text(await _agemini_post(api_key, model, payload, timeout))
+
+
+async def _acall_gemini_rest_with_image(
+    api_key: str,
+    model: str,
+    prompt: str,
+    image_base64: str,
+    mime_type: str = "image/png",
+    timeout: int = GEMINI_TIMEOUT,
+    expect_json: bool = False,
+) -> str:
+    """_call_gemini_rest_with_image 的异步版本（httpx）。"""
+    payload = _payload(_image_contents(prompt, image_base64, mime_type), expect_json)
+    return _response_text(await _agemini_post(api_key, model, payload, timeout))
+
+
+def _sse_chunk_text(line: str) -> str:
+    """Text carried by one `data:` line of a streamGenerateContent SSE response."""
+    if not line.startswith("data:"):
+        return ""
+    try:
+        return "".join(
+            part.get("text", "")
+            for part in orjson.loads(line[5:])["candidates"][0]["content"]["parts"]
+        )
+    except (orjson.JSONDecodeError, KeyError, IndexError):
+        return ""
+
+
+class _JsonStringStream:
+    """
+    Incrementally decodes one string field of a JSON object that arrives in
+    chunks: feed() returns the newly decoded text of the field's value.
+    
+    Each character is scanned once; only an undecoded tail (a cut-off escape
+    sequence, or a partial key) is carried over to the next chunk.
+    """
+
+    _AFTER_KEY = re.compile(r'\s*:\s*"')
+    _AFTER_KEY_PARTIAL = re.compile(r'\s*(:\s*)?')
+    # Raw control characters are invalid in JSON strings but models emit them
+    _CONTROL_ESCAPES = {c: f"\\u{c:04x}" for c in range(32)}
+
+    def __init__(self, field: str):
+        self.field = field
+        self._key = f'"{field}"'
+        self._head = ""  # text before the value while looking for the key
+        self._raw = None  # undecoded part of the value once it has started
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        if self._done:
+            return ""
+        if self._raw is None:
+            self._head += chunk
+            if not self._find_value():
+                return ""
+        else:
+            self._raw += chunk
+        return self._decode()
+
+    def _find_value(self) -> bool:
+        """Look for `"field": "` in the head; on success the rest becomes the raw value."""
+        head, key = self._head, self._key
+        pos = 0
+        while True:
+            k = head.find(key, pos)
+            if k == -1:
+                # Keep only a tail that could still be the start of the key
+                self._head = head[max(pos, len(head) - len(key) + 1):]
+                return False
+            rest = k + len(key)
+            match = self._AFTER_KEY.match(head, rest)
+            if match:
+                self._head = ""
+                self._raw = head[match.end():]
+                return True
+            if self._AFTER_KEY_PARTIAL.fullmatch(head, rest):
+                self._head = head[k:]  # key found, colon / quote not here yet
+                return False
+            pos = k + 1
+
+    def _decode(self) -> str:
+        raw = self._raw
+        n = len(raw)
+        i = 0
+        while i < n and raw[i] != '"':
+            if raw[i] != "\\":
+                i += 1
+            elif i + 1 >= n:
+                break
+            elif raw[i + 1] != "u":
+                i += 2
+            elif i + 6 > n or (raw[i + 2:i + 4].lower() in ("d8", "d9", "da", "db") and i + 12 > n):
+                break  # incomplete \uXXXX (or the first half of a surrogate pair)
+            else:
+                i += 6
+        if i < n and raw[i] == '"':
+            self._done = True
+        self._raw = raw[i:]
+        try:
+            return orjson.loads(f'"{raw[:i].translate(self._CONTROL_ESCAPES)}"')
+        except orjson.JSONDecodeError:
+            self._done = True  # malformed escape: leave the rest to the final result
+            return ""
+
+
+async def _agemini_stream(
+    api_key: str, model: str, payload: Dict, timeout: int = GEMINI_TIMEOUT
+) -> AsyncIterator[str]:
+    """Stream a generateContent payload (httpx), yielding text chunks as Gemini produces them. No retries once output has started."""
+    client = _get_async_client()
+    async with client.stream(
+        "POST", _gemini_stream_url(model), headers=_gemini_headers(api_key), json=payload, timeout=timeout
+    ) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            text = _sse_chunk_text(line)
+            if text:
+                yield text
+
+
+FEEDBACK_CACHE_SIZE = 4096
+TRANSFER_CACHE_SIZE = 512
+VISION_CACHE_TTL_SECONDS = 7 * 86400
+
+# Outermost {...} span in a model reply
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+
+def _prompt_digest(prompt: str) -> bytes:
+    """Compact cache key for a full prompt text."""
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+
+
+class _LRUCache:
+    """Small thread-safe LRU map (LLM calls may run in worker threads)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class _VisionCache:
+    """
+    Parsed vision-model results stored as JSON files, keyed by image content.
+    
+    Lives on disk so a re-uploaded image skips the upload and the vision call
+    even after a restart; entries older than ttl seconds are deleted when
+    read or swept by prune().
+    """
+
+    def __init__(self, directory: Path, ttl: int):
+        self.directory = directory
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        path = self.directory / f"{key}.json"
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            return orjson.loads(path.read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+
+    def put(self, key: str, value: Dict) -> None:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.directory / f"{key}.{threading.get_ident()}.tmp"
+            tmp_path.write_bytes(orjson.dumps(value))
+            os.replace(tmp_path, self.directory / f"{key}.json")
+        except OSError as e:
+            logger.warning("Vision cache write failed: %s", e)
+
+    def prune(self) -> int:
+        """Delete expired entries and leftover temp files; returns how many were removed."""
+        if not self.directory.is_dir():
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for path in self.directory.iterdir():
+            try:
+                if path.suffix == ".tmp" or path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+def _image_digest(image_base64: str) -> "hashlib.blake2b":
+    """Hash of the decoded image bytes, so data-URL prefixes and line breaks do not change the key."""
+    data = image_base64.partition(",")[2] if image_base64.startswith("data:") else image_base64
+    data = "".join(data.split())
+    try:
+        raw = base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        raw = data.encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=16)
+
+
+# String fields of the reasoning reply whose text is streamed as it arrives
+REASONING_STREAM_FIELDS = ("evaluation", "standard_solution")
+
+# Vision models downscale internally, so larger uploads only cost transfer time
+VISION_MAX_EDGE = 1536
+VISION_JPEG_QUALITY = 85
+
+
+def _optimize_image(image_base64: str, mime_type: str) -> Tuple[str, str]:
+    """
+    Downscale an image to VISION_MAX_EDGE and re-encode it as JPEG before upload.
+    
+    Returns the input unchanged when Pillow is missing, the image cannot be
+    decoded, or re-encoding would not make it smaller.
+    """
+    if Image is None:
+        return image_base64, mime_type
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(image_base64))) as img:
+            img.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.Resampling.LANCZOS)
+            if img.mode != "RGB":
+                # JPEG has no alpha: flatten transparent areas onto white
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    except Exception as e:
+        logger.warning("Image optimization skipped: %s", e)
+        return image_base64, mime_type
+    optimized = base64.b64encode(buf.getvalue()).decode("ascii")
+    if len(optimized) >= len(image_base64):
+        return image_base64, mime_type
+    return optimized, "image/jpeg"
+
+
+# Static tails of the per-call prompts; the variable fields are joined in front of them
+FEEDBACK_PROMPT_SUFFIX = """
+
+请基于预设反馈，生成一条简洁的引导性回复（不超过2句话）。
+- 如果正确：确认判断，简述为什么这是关键决策
+- 如果错误：指出逻辑问题，但不要透露正确答案
+
+回复："""
+
+TRANSFER_PROMPT_SUFFIX = """
+
+请生成一道同结构但数值/情境不同的迁移题，用于验证学生是否真正掌握了解题思路。
+- 保持相同的物理概念和解题逻辑
+- 改变具体数值或场景
+- 减少引导，让学生更独立思考
+
+迁移题目："""
+
+REASONING_PROMPT_HEAD = """
+请作为物理导师，评价学生关于这道题的解题思路，并提供标准解析。
+
+题目信息：
+描述："""
+
+REASONING_PROMPT_SUFFIX = """"
+
+请按以下 JSON 格式返回（不要使用 markdown code block，直接返回 JSON）：
+{
+    "evaluation": "对学生思路的点评（指出亮点和不足，语气鼓励）",
+    "standard_solution": "清晰的标准解题步骤和解析"
+}
+"""
+
+
+IMAGE_ANALYSIS_PROMPT = """你是一位初中物理出题老师。请分析这张物理题图片，并按照以下要求处理：
+
+【任务】
+1. 识别题目的完整内容（包括文字描述、图形、已知条件、问题）
+2. 确定题目的物理主题（如：压强、浮力、电路、运动等）
+3. 将题目拆解为 3-5 个关键判断步骤，每步引导学生思考一个核心要点
+4. 为每步设计 4 个选项（A/B/C/D），包含 1 个正确答案和合理的干扰项
+5. 提供正确和错误时的简短反馈
+
+【要求】
+- 步骤设计要符合解题逻辑顺序（概念判断 → 模型选择 → 计算方向 → 结果验证）
+- 干扰项要基于常见误解设计，不要随意编造
+- 反馈要简洁（1-2句话），正确时肯定+解释，错误时提示但不直接给答案
+- 必须返回合法 JSON，不要包含 markdown 代码块标记
+
+【返回 JSON 格式】
+{
+  "topic": "题目的物理主题（如：液体压强与固体压强综合）",
+  "difficulty": "中考",
+  "question_context": {
+    "description": "题目的完整描述（含已知条件、情境说明）",
+    "ask": ["① 第一问...", "② 第二问...", "③ 第三问..."]
+  },
+  "guided_steps": [
+    {
+      "step_id": 1,
+      "type": "concept_judgement",
+      "prompt": "第一步的判断问题（引导学生思考某个核心概念）",
+      "options": ["A. 选项A", "B. 选项B", "C. 选项C", "D. 选项D"],
+      "correct": "B",
+      "feedback": {
+        "correct": "正确！简短肯定 + 原因说明",
+        "incorrect": "这个选择有问题。提示性引导，不直接给答案"
+      }
+    }
+  ]
+}
+
+请只输出 JSON，不要其他说明。"""
 
 
 class LLMService:
@@ -93,50 +579,119 @@ class LLMService:
         # Gemini setup
         self.gemini_api_key = settings.gemini_api_key
         self.gemini_model = settings.gemini_model
+        self.gemini_model_fast = settings.gemini_model_fast
         
         # Zhipu setup
         self.zhipu_api_key = settings.zhipu_api_key
         self.zhipu_model = settings.zhipu_model
+        self.zhipu_model_fast = settings.zhipu_model_fast
         self.zhipu_vision_model = settings.zhipu_vision_model
         self.zhipu_client = None
         
         if self.zhipu_api_key:
             try:
-                from zhipuai import ZhipuAI
                 self.zhipu_client = ZhipuAI(api_key=self.zhipu_api_key)
             except Exception as e:
-                print(f"Failed to initialize Zhipu client: {e}")
+                logger.warning("Failed to initialize Zhipu client: %s", e)
         
         self.system_prompt = get_system_prompt()
         self.timeout = GEMINI_TIMEOUT
+        
+        # Static heads of the feedback / transfer prompts. The system prompt is not part of
+        # them: it travels as Zhipu's system message / Gemini's systemInstruction instead.
+        self._feedback_prefix = "当前情境：\n"
+        self._transfer_prefix = "原题信息：\n"
+        
+        # prompt digest -> generated feedback
+        self._feedback_cache = _LRUCache(FEEDBACK_CACHE_SIZE)
+        # prompt digest -> generated transfer question text
+        self._transfer_cache = _LRUCache(TRANSFER_CACHE_SIZE)
+        # image digest (+ provider, model, prompt) -> parsed vision result
+        self._vision_cache = _VisionCache(settings.cache_dir / "vision", VISION_CACHE_TTL_SECONDS)
+        
+        # Keys and client are fixed after init, so resolve this once
+        if self.provider == "zhipu":
+            self._configured = bool(self.zhipu_api_key and self.zhipu_client)
+        else:
+            self._configured = bool(self.gemini_api_key and self.gemini_api_key.strip())
 
     def is_configured(self) -> bool:
         """Check if the current provider is properly configured."""
-        if self.provider == "zhipu":
-            return bool(self.zhipu_api_key and self.zhipu_client)
-        return bool(self.gemini_api_key and self.gemini_api_key.strip())
+        return self._configured
 
     def _extract_json(self, text: str) -> Dict:
         """Helper to extract JSON object from text (with regex fallback)."""
-        import re
         try:
             # 尝试正则提取 JSON
-            json_match = re.search(r'\{.*\}', text, re.DOTALL)
+            json_match = _JSON_OBJECT_RE.search(text)
             if json_match:
                 json_str = json_match.group(0)
                 try:
-                    return json.loads(json_str)
-                except json.JSONDecodeError:
+                    return orjson.loads(json_str)
+                except orjson.JSONDecodeError:
                     pass
             # 正则失败或无匹配，尝试全文解析
-            return json.loads(text)
-        except json.JSONDecodeError:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
             # 再次尝试清理 markdown 后解析
             clean_text = text.replace("```json", "").replace("```", "").strip()
-            return json.loads(clean_text)
+            return orjson.loads(clean_text)
+
+    def _loads_json_object(self, text: str) -> Dict:
+        """Parse a JSON-mode reply directly; fall back to the lenient extractor for stray wrapping."""
+        try:
+            result = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            result = None
+        if isinstance(result, dict):
+            return result
+        return self._extract_json(text)
+
+    def _text_model(self, tier: str = "default") -> str:
+        """Model for text calls: tier "fast" picks the cheaper model used for short step feedback."""
+        if self.provider == "zhipu":
+            return self.zhipu_model_fast if tier == "fast" else self.zhipu_model
+        return self.gemini_model_fast if tier == "fast" else self.gemini_model
 
-    def _call_zhipu(self, prompt: str) -> str:
-        """Call Zhipu AI GLM-4 model."""
+    async def a_warmup(self) -> None:
+        """
+        Open the provider connection (DNS + TCP + TLS) before the first student
+        request. Gemini gets a cheap model-list GET on the shared async client;
+        Zhipu a 1-token completion through its SDK. Failures are only logged.
+        """
+        if not self.is_configured():
+            return
+        try:
+            if self.provider == "zhipu":
+                await asyncio.to_thread(
+                    self.zhipu_client.chat.completions.create,
+                    model=self.zhipu_model_fast,
+                    messages=[{"role": "user", "content": "ping"}],
+                    max_tokens=1,
+                )
+            else:
+                await _get_async_client().get(
+                    _gemini_models_url(), headers=_gemini_headers(self.gemini_api_key), timeout=WARMUP_TIMEOUT
+                )
+        except Exception as e:
+            logger.warning("LLM warmup failed: %s", e)
+
+    def prune_vision_cache(self) -> None:
+        """Delete expired vision cache entries (run at startup)."""
+        removed = self._vision_cache.prune()
+        if removed:
+            logger.info("Pruned %d expired vision cache entries", removed)
+
+    def _vision_cache_key(self, image_base64: str, prompt: str) -> str:
+        """Cache key for a vision call: the image content plus everything that shapes the reply."""
+        model = self.zhipu_vision_model if self.provider == "zhipu" else self.gemini_model
+        digest = _image_digest(image_base64)
+        for part in (self.provider, model, prompt):
+            digest.update(b"\0" + part.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _call_zhipu(self, prompt: str, expect_json: bool = False, tier: str = "default") -> str:
+        """Call Zhipu AI GLM-4 model (expect_json requests a JSON object reply)."""
         if not self.zhipu_client:
             raise ValueError("Zhipu client not initialized")
             
@@ -145,10 +700,12 @@ class LLMService:
             messages.append({"role": "system", "content": self.system_prompt})
         messages.append({"role": "user", "content": prompt})
         
+        extra = {"response_format": {"type": "json_object"}} if expect_json else {}
         response = self.zhipu_client.chat.completions.create(
-            model=self.zhipu_model,
+            model=self._text_model(tier),
             messages=messages,
             temperature=0.7,
+            **extra,
         )
         return response.choices[0].message.content.strip()
 
@@ -189,62 +746,147 @@ class LLMService:
         )
         return response.choices[0].message.content.strip()
 
-    def _generate_content(self, prompt: str) -> str:
-        """Generate content using the configured provider."""
+    def _gemini_system(self, system: bool) -> Optional[str]:
+        """systemInstruction for a Gemini call (Zhipu calls always carry the system message)."""
+        return self.system_prompt if system else None
+
+    def _generate_content(
+        self, prompt: str, expect_json: bool = False, tier: str = "default", system: bool = False
+    ) -> str:
+        """Generate content using the configured provider; system adds the tutor prompt for Gemini."""
+        if self.provider == "zhipu":
+            return self._call_zhipu(prompt, expect_json, tier)
+        return _call_gemini_rest(
+            self.gemini_api_key, self._text_model(tier), prompt, timeout=self.timeout,
+            expect_json=expect_json, system_instruction=self._gemini_system(system)
+        )
+
+    async def _agenerate_content(
+        self, prompt: str, expect_json: bool = False, tier: str = "default", system: bool = False
+    ) -> str:
+        """_generate_content 的异步版本：Gemini 走 httpx，Zhipu SDK 放到工作线程。"""
+        if self.provider == "zhipu":
+            return await asyncio.to_thread(self._call_zhipu, prompt, expect_json, tier)
+        return await _acall_gemini_rest(
+            self.gemini_api_key, self._text_model(tier), prompt, timeout=self.timeout,
+            expect_json=expect_json, system_instruction=self._gemini_system(system)
+        )
+
+    def _stream_zhipu(self, prompt: str, expect_json: bool = False, tier: str = "default") -> Iterator[str]:
+        """Stream a Zhipu completion, yielding content deltas."""
+        if not self.zhipu_client:
+            raise ValueError("Zhipu client not initialized")
+
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.append({"role": "user", "content": prompt})
+
+        extra = {"response_format": {"type": "json_object"}} if expect_json else {}
+        response = self.zhipu_client.chat.completions.create(
+            model=self._text_model(tier),
+            messages=messages,
+            temperature=0.7,
+            stream=True,
+            **extra,
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _astream_content(
+        self, prompt: str, expect_json: bool = False, tier: str = "default", system: bool = False
+    ) -> AsyncIterator[str]:
+        """Streaming counterpart of _agenerate_content; the Zhipu SDK iterator is pulled on a worker thread."""
         if self.provider == "zhipu":
-            return self._call_zhipu(prompt)
-        return _call_gemini_rest(self.gemini_api_key, self.gemini_model, prompt, timeout=self.timeout)
+            chunks = self._stream_zhipu(prompt, expect_json, tier)
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        else:
+            payload = _payload(_text_contents(prompt), expect_json, self._gemini_system(system))
+            model = self._text_model(tier)
+            async for chunk in _agemini_stream(self.gemini_api_key, model, payload, self.timeout):
+                yield chunk
 
     def generate_feedback(
         self,
         step_prompt: str,
         student_choice: str,
         is_correct: bool,
-        base_feedback: str,
-        context: Optional[str] = None
+        base_feedback: str
     ) -> str:
         """
         Generate enhanced AI feedback for a student's choice.
+        
+        Results are cached by a digest of the full prompt: every student making
+        the same choice on the same step text builds the same prompt, while a
+        regenerated question (even under a reused id) gets fresh feedback.
         """
         if not self.is_configured():
             return base_feedback
 
+        prompt = self._build_feedback_prompt(step_prompt, student_choice, is_correct, base_feedback)
+        cache_key = _prompt_digest(prompt)
+        cached = self._feedback_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            prompt = self._build_feedback_prompt(
-                step_prompt, student_choice, is_correct, base_feedback, context
-            )
-            return self._generate_content(prompt)
-        except Exception as e:
-            print(f"LLM API error: {e}")
+            feedback = self._generate_content(prompt, tier="fast", system=True)
+            if feedback:
+                self._feedback_cache.put(cache_key, feedback)
+            return feedback
+        except Exception:
+            logger.exception("LLM API error")
             return base_feedback
 
-    def _build_feedback_prompt(
+    async def a_generate_feedback(
         self,
         step_prompt: str,
         student_choice: str,
         is_correct: bool,
-        base_feedback: str,
-        context: Optional[str] = None
+        base_feedback: str
     ) -> str:
-        """Build the prompt for feedback generation."""
-        status = "正确" if is_correct else "错误"
-
-        prompt = f"""{self.system_prompt}
+        """generate_feedback 的异步版本，不阻塞事件循环（共用同一反馈缓存）。"""
+        if not self.is_configured():
+            return base_feedback
 
----
-当前情境：
-题目步骤：{step_prompt}
-学生选择：{student_choice}
-判断结果：{status}
-预设反馈：{base_feedback}
+        prompt = self._build_feedback_prompt(step_prompt, student_choice, is_correct, base_feedback)
+        cache_key = _prompt_digest(prompt)
+        cached = self._feedback_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-请基于预设反馈，生成一条简洁的引导性回复（不超过2句话）。
-- 如果正确：确认判断，简述为什么这是关键决策
-- 如果错误：指出逻辑问题，但不要透露正确答案
+        try:
+            feedback = await self._agenerate_content(prompt, tier="fast", system=True)
+            if feedback:
+                self._feedback_cache.put(cache_key, feedback)
+            return feedback
+        except Exception:
+            logger.exception("LLM API error")
+            return base_feedback
 
-回复："""
+    def _build_feedback_prompt(
+        self,
+        step_prompt: str,
+        student_choice: str,
+        is_correct: bool,
+        base_feedback: str
+    ) -> str:
+        """Build the prompt for feedback generation."""
+        status = "正确" if is_correct else "错误"
 
-        return prompt
+        return "".join((
+            self._feedback_prefix,
+            "题目步骤：", step_prompt,
+            "\n学生选择：", student_choice,
+            "\n判断结果：", status,
+            "\n预设反馈：", base_feedback,
+            FEEDBACK_PROMPT_SUFFIX,
+        ))
 
     def generate_transfer_prompt(
         self,
@@ -257,31 +899,57 @@ class LLMService:
         if not self.is_configured():
             return "（迁移题目生成需要配置 API）"
 
-        try:
-            prompt = f"""{self.system_prompt}
-
----
-原题信息：
-主题：{original_question.get('topic', '')}
-难度：{original_question.get('difficulty', '')}
-描述：{original_question.get('question_context', {}).get('description', '')}
+        prompt = self._build_transfer_prompt(original_question, student_performance)
+        cache_key = _prompt_digest(prompt)
+        cached = self._transfer_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-学生表现：
-正确率：{student_performance.get('accuracy', 0):.1%}
-完成步骤：{student_performance.get('completed_steps', 0)}
+        try:
+            text = self._generate_content(prompt, system=True)
+            if text:
+                self._transfer_cache.put(cache_key, text)
+            return text
+        except Exception:
+            logger.exception("LLM API error")
+            return "（迁移题目生成失败，请检查 API 配置）"
 
-请生成一道同结构但数值/情境不同的迁移题，用于验证学生是否真正掌握了解题思路。
-- 保持相同的物理概念和解题逻辑
-- 改变具体数值或场景
-- 减少引导，让学生更独立思考
+    async def a_generate_transfer_prompt(
+        self,
+        original_question: Dict,
+        student_performance: Dict
+    ) -> str:
+        """generate_transfer_prompt 的异步版本，不阻塞事件循环。"""
+        if not self.is_configured():
+            return "（迁移题目生成需要配置 API）"
 
-迁移题目："""
+        prompt = self._build_transfer_prompt(original_question, student_performance)
+        cache_key = _prompt_digest(prompt)
+        cached = self._transfer_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-            return self._generate_content(prompt)
-        except Exception as e:
-            print(f"LLM API error: {e}")
+        try:
+            text = await self._agenerate_content(prompt, system=True)
+            if text:
+                self._transfer_cache.put(cache_key, text)
+            return text
+        except Exception:
+            logger.exception("LLM API error")
             return "（迁移题目生成失败，请检查 API 配置）"
 
+    def _build_transfer_prompt(self, original_question: Dict, student_performance: Dict) -> str:
+        """Build the prompt for transfer question generation."""
+        return "".join((
+            self._transfer_prefix,
+            "主题：", str(original_question.get('topic', '')),
+            "\n难度：", str(original_question.get('difficulty', '')),
+            "\n描述：", str(original_question.get('question_context', {}).get('description', '')),
+            "\n\n学生表现：\n正确率：", format(student_performance.get('accuracy', 0), ".1%"),
+            "\n完成步骤：", str(student_performance.get('completed_steps', 0)),
+            TRANSFER_PROMPT_SUFFIX,
+        ))
+
     def chat(
         self,
         messages: List[Dict[str, str]],
@@ -313,20 +981,22 @@ class LLMService:
                 return response.choices[0].message.content.strip()
             
             else:
-                # Gemini REST (简单实现，拼接 prompt)
-                parts = []
-                if self.system_prompt:
-                    parts.append(f"[System Instructions]\n{self.system_prompt}\n\n")
+                # Gemini REST：整段对话（含 assistant 轮次）一次请求发出
+                turns = []
                 for msg in messages:
-                    if msg.get("role") == "user":
-                        parts.append(msg.get("content", ""))
-                prompt = "\n".join(parts).strip()
-                if not prompt:
+                    content = msg.get("content", "")
+                    if content:
+                        role = "model" if msg.get("role") == "assistant" else "user"
+                        turns.append({"role": role, "parts": [{"text": content}]})
+                if not turns:
                     return ""
-                return self._generate_content(prompt)
+                return _call_gemini_rest_contents(
+                    self.gemini_api_key, self.gemini_model, turns, timeout=self.timeout,
+                    system_instruction=self.system_prompt
+                )
                 
         except Exception as e:
-            print(f"LLM API error (chat): {e}")
+            logger.exception("LLM API error (chat)")
             return f"（API 调用失败：{str(e)}）"
 
     def analyze_reasoning(
@@ -345,68 +1015,128 @@ class LLMService:
             }
 
         try:
-            prompt = f"""
-请作为物理导师，评价学生关于这道题的解题思路，并提供标准解析。
-
-题目信息：
-描述：{question.question_context.description}
-问题：{question.question_context.ask}
-
-学生的解题思路：
-"{student_reasoning}"
-
-请按以下 JSON 格式返回（不要使用 markdown code block，直接返回 JSON）：
-{{
-    "evaluation": "对学生思路的点评（指出亮点和不足，语气鼓励）",
-    "standard_solution": "清晰的标准解题步骤和解析"
-}}
-"""
             # 如果学生上传了解题图片（目前还不支持把图片传给 reasoning endpoint，但为了扩展性保留接口）
             # 现在只处理文本 prompt
-            text = self._generate_content(prompt)
-
-            # 尝试清理 markdown
-            if text.startswith("```json"):
-                text = text.replace("```json", "").replace("```", "")
-            elif text.startswith("```"):
-                text = text.replace("```", "")
-            
-            text = text.strip()
+            text = self._generate_content(
+                self._build_reasoning_prompt(question, student_reasoning), expect_json=True
+            )
+            return self._parse_reasoning(text)
+        except Exception as e:
+            logger.exception("LLM API error (analyze)")
+            return {
+                "evaluation": f"（评价生成失败，请稍后重试。错误信息：{str(e)}）",
+                "standard_solution": "（解析生成失败）"
+            }
 
-            try:
-                result = self._extract_json(text)
-
-                for field in ["evaluation", "standard_solution"]:
-                    val = result.get(field)
-                    if val is None:
-                        result[field] = ""
-                    elif not isinstance(val, str):
-                        if isinstance(val, dict):
-                            lines = []
-                            for k, v in val.items():
-                                lines.append(f"{k}：{v}")
-                            result[field] = "\n".join(lines)
-                        elif isinstance(val, list):
-                            result[field] = "\n".join([str(x) for x in val])
-                        else:
-                            result[field] = str(val)
-                return result
-            except json.JSONDecodeError as je:
-                print(f"JSON Parse Error: {je}, Text: {text}")
-                return {
-                    "evaluation": f"（解析生成格式异常，原始内容：{text}）",
-                    "standard_solution": "（解析生成失败）"
-                }
+    async def a_analyze_reasoning(
+        self,
+        question: "Question",
+        student_reasoning: str,
+        student_image: Optional[str] = None
+    ) -> Dict[str, str]:
+        """analyze_reasoning 的异步版本，不阻塞事件循环。"""
+        if not self.is_configured():
+            return {
+                "evaluation": "（API 未配置，无法评价）",
+                "standard_solution": "（API 未配置，无法生成解析）"
+            }
 
+        try:
+            text = await self._agenerate_content(
+                self._build_reasoning_prompt(question, student_reasoning), expect_json=True
+            )
+            return self._parse_reasoning(text)
         except Exception as e:
-            print(f"LLM API error (analyze): {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("LLM API error (analyze)")
             return {
                 "evaluation": f"（评价生成失败，请稍后重试。错误信息：{str(e)}）",
                 "standard_solution": "（解析生成失败）"
             }
 
+    async def a_stream_reasoning(
+        self,
+        question: "Question",
+        student_reasoning: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of a_analyze_reasoning.
+        
+        The model replies in JSON, so instead of raw chunks this yields
+        {"delta": {"field": "evaluation" | "standard_solution", "text": ...}}
+        with newly decoded text of each field as it arrives, then one
+        {"result": {...}} with the same dict a_analyze_reasoning returns.
+        """
+        if not self.is_configured():
+            yield {"result": {
+                "evaluation": "（API 未配置，无法评价）",
+                "standard_solution": "（API 未配置，无法生成解析）"
+            }}
+            return
+
+        chunks = []
+        decoders = [_JsonStringStream(field) for field in REASONING_STREAM_FIELDS]
+        try:
+            prompt = self._build_reasoning_prompt(question, student_reasoning)
+            async for chunk in self._astream_content(prompt, expect_json=True):
+                chunks.append(chunk)
+                for decoder in decoders:
+                    text = decoder.feed(chunk)
+                    if text:
+                        yield {"delta": {"field": decoder.field, "text": text}}
+        except Exception as e:
+            logger.exception("LLM API error (analyze stream)")
+            yield {"result": {
+                "evaluation": f"（评价生成失败，请稍后重试。错误信息：{str(e)}）",
+                "standard_solution": "（解析生成失败）"
+            }}
+            return
+        yield {"result": self._parse_reasoning("".join(chunks).strip())}
+
+    @staticmethod
+    def _build_reasoning_prompt(question: "Question", student_reasoning: str) -> str:
+        """Build the prompt for reasoning evaluation."""
+        return "".join((
+            REASONING_PROMPT_HEAD, question.question_context.description,
+            "\n问题：", str(question.question_context.ask),
+            "\n\n学生的解题思路：\n\"", student_reasoning,
+            REASONING_PROMPT_SUFFIX,
+        ))
+
+    def _parse_reasoning(self, text: str) -> Dict[str, str]:
+        """Turn the model's reasoning reply into evaluation / standard_solution strings."""
+        # 尝试清理 markdown
+        if text.startswith("```json"):
+            text = text.replace("```json", "").replace("```", "")
+        elif text.startswith("```"):
+            text = text.replace("```", "")
+        
+        text = text.strip()
+
+        try:
+            result = self._loads_json_object(text)
+
+            for field in ["evaluation", "standard_solution"]:
+                val = result.get(field)
+                if val is None:
+                    result[field] = ""
+                elif not isinstance(val, str):
+                    if isinstance(val, dict):
+                        lines = []
+                        for k, v in val.items():
+                            lines.append(f"{k}：{v}")
+                        result[field] = "\n".join(lines)
+                    elif isinstance(val, list):
+                        result[field] = "\n".join([str(x) for x in val])
+                    else:
+                        result[field] = str(val)
+            return result
+        except orjson.JSONDecodeError as je:
+            logger.warning("JSON Parse Error: %s, Text: %s", je, text)
+            return {
+                "evaluation": f"（解析生成格式异常，原始内容：{text}）",
+                "standard_solution": "（解析生成失败）"
+            }
+
     def generate_similar_question(
         self,
         question: "Question",
@@ -420,8 +1150,64 @@ class LLMService:
             return None
 
         try:
-            ctx = question.question_context
-            prompt = f"""你是一位初中物理出题老师。请根据下面这张原题图片和题目信息，出一道「思路类似但情境或数值不完全一样」的新题，用于考察学生是否真正学会了解题思路。
+            prompt = self._build_similar_question_prompt(question)
+            # Not cached: every request should get a freshly generated question
+            if image_base64:
+                image_base64, mime_type = _optimize_image(image_base64, mime_type)
+
+            text = ""
+            if self.provider == "zhipu" and image_base64:
+                text = self._call_zhipu_with_image(prompt, image_base64, mime_type)
+            elif self.provider == "gemini" and image_base64:
+                text = _call_gemini_rest_with_image(
+                    self.gemini_api_key, self.gemini_model, prompt, image_base64, mime_type, self.timeout,
+                    expect_json=True
+                )
+            else:
+                text = self._generate_content(prompt, expect_json=True)
+
+            return self._parse_similar_question(question, text)
+        except Exception:
+            logger.exception("LLM API error (generate_similar_question)")
+            return None
+
+    async def a_generate_similar_question(
+        self,
+        question: "Question",
+        image_base64: str,
+        mime_type: str = "image/png",
+    ) -> Optional[Dict]:
+        """generate_similar_question 的异步版本，不阻塞事件循环。"""
+        if not self.is_configured():
+            return None
+
+        try:
+            prompt = self._build_similar_question_prompt(question)
+            # Not cached: every request should get a freshly generated question
+            if image_base64:
+                image_base64, mime_type = await asyncio.to_thread(_optimize_image, image_base64, mime_type)
+
+            text = ""
+            if self.provider == "zhipu" and image_base64:
+                text = await asyncio.to_thread(self._call_zhipu_with_image, prompt, image_base64, mime_type)
+            elif self.provider == "gemini" and image_base64:
+                text = await _acall_gemini_rest_with_image(
+                    self.gemini_api_key, self.gemini_model, prompt, image_base64, mime_type, self.timeout,
+                    expect_json=True
+                )
+            else:
+                text = await self._agenerate_content(prompt, expect_json=True)
+
+            return self._parse_similar_question(question, text)
+        except Exception:
+            logger.exception("LLM API error (generate_similar_question)")
+            return None
+
+    @staticmethod
+    def _build_similar_question_prompt(question: "Question") -> str:
+        """Build the prompt asking for a similar question."""
+        ctx = question.question_context
+        return f"""你是一位初中物理出题老师。请根据下面这张原题图片和题目信息，出一道「思路类似但情境或数值不完全一样」的新题，用于考察学生是否真正学会了解题思路。
 
 【原题信息】
 主题：{question.topic}
@@ -458,62 +1244,51 @@ class LLMService:
 
 请只输出上述 JSON，不要其他说明。"""
 
-            text = ""
-            if self.provider == "zhipu" and image_base64:
-                text = self._call_zhipu_with_image(prompt, image_base64, mime_type)
-            elif self.provider == "gemini" and image_base64:
-                text = _call_gemini_rest_with_image(
-                    self.gemini_api_key, self.gemini_model, prompt, image_base64, mime_type, self.timeout
-                )
-            else:
-                text = self._generate_content(prompt)
-
-            if text.startswith("```"):
-                text = text.split("```")[1]
-                if text.startswith("json"):
-                    text = text[4:]
-            text = text.strip()
+    def _parse_similar_question(self, question: "Question", text: str) -> Optional[Dict]:
+        """Turn the model's reply into a Question dict based on the source question (None if unusable)."""
+        if text.startswith("```"):
+            text = text.split("```")[1]
+            if text.startswith("json"):
+                text = text[4:]
+        text = text.strip()
 
-            qc = {}
-            steps = []
-            try:
-                raw = self._extract_json(text)
-                qc = raw.get("question_context") or {}
-                steps = raw.get("guided_steps") or []
-            except Exception:
-                pass
-
-            if not qc or not steps:
-                return None
+        qc = {}
+        steps = []
+        try:
+            raw = self._loads_json_object(text)
+            qc = raw.get("question_context") or {}
+            steps = raw.get("guided_steps") or []
+        except Exception:
+            pass
 
-            return {
-                "topic": question.topic,
-                "difficulty": question.difficulty,
-                "image": question.image,
-                "question_context": {
-                    "description": qc.get("description", ""),
-                    "ask": qc.get("ask") or [],
-                },
-                "guided_steps": [
-                    {
-                        "step_id": s.get("step_id", i + 1),
-                        "type": s.get("type", "concept_judgement"),
-                        "prompt": s.get("prompt", ""),
-                        "options": s.get("options") or [],
-                        "correct": s.get("correct", "A"),
-                        "feedback": {
-                            "correct": (s.get("feedback") or {}).get("correct", ""),
-                            "incorrect": (s.get("feedback") or {}).get("incorrect", ""),
-                        },
-                    }
-                    for i, s in enumerate(steps)
-                ],
-                "next_similar_question_id": None,
-            }
-        except Exception as e:
-            print(f"LLM API error (generate_similar_question): {e}")
+        if not qc or not steps:
             return None
 
+        return {
+            "topic": question.topic,
+            "difficulty": question.difficulty,
+            "image": question.image,
+            "question_context": {
+                "description": qc.get("description", ""),
+                "ask": qc.get("ask") or [],
+            },
+            "guided_steps": [
+                {
+                    "step_id": s.get("step_id", i + 1),
+                    "type": s.get("type", "concept_judgement"),
+                    "prompt": s.get("prompt", ""),
+                    "options": s.get("options") or [],
+                    "correct": s.get("correct", "A"),
+                    "feedback": {
+                        "correct": (s.get("feedback") or {}).get("correct", ""),
+                        "incorrect": (s.get("feedback") or {}).get("incorrect", ""),
+                    },
+                }
+                for i, s in enumerate(steps)
+            ],
+            "next_similar_question_id": None,
+        }
+
     def analyze_physics_image(
         self,
         image_base64: str,
@@ -525,107 +1300,122 @@ class LLMService:
         if not self.is_configured():
             return None
         
+        cache_key = self._vision_cache_key(image_base64, IMAGE_ANALYSIS_PROMPT)
+        cached = self._vision_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            prompt = """你是一位初中物理出题老师。请分析这张物理题图片，并按照以下要求处理：
-
-【任务】
-1. 识别题目的完整内容（包括文字描述、图形、已知条件、问题）
-2. 确定题目的物理主题（如：压强、浮力、电路、运动等）
-3. 将题目拆解为 3-5 个关键判断步骤，每步引导学生思考一个核心要点
-4. 为每步设计 4 个选项（A/B/C/D），包含 1 个正确答案和合理的干扰项
-5. 提供正确和错误时的简短反馈
-
-【要求】
-- 步骤设计要符合解题逻辑顺序（概念判断 → 模型选择 → 计算方向 → 结果验证）
-- 干扰项要基于常见误解设计，不要随意编造
-- 反馈要简洁（1-2句话），正确时肯定+解释，错误时提示但不直接给答案
-- 必须返回合法 JSON，不要包含 markdown 代码块标记
-
-【返回 JSON 格式】
-{
-  "topic": "题目的物理主题（如：液体压强与固体压强综合）",
-  "difficulty": "中考",
-  "question_context": {
-    "description": "题目的完整描述（含已知条件、情境说明）",
-    "ask": ["① 第一问...", "② 第二问...", "③ 第三问..."]
-  },
-  "guided_steps": [
-    {
-      "step_id": 1,
-      "type": "concept_judgement",
-      "prompt": "第一步的判断问题（引导学生思考某个核心概念）",
-      "options": ["A. 选项A", "B. 选项B", "C. 选项C", "D. 选项D"],
-      "correct": "B",
-      "feedback": {
-        "correct": "正确！简短肯定 + 原因说明",
-        "incorrect": "这个选择有问题。提示性引导，不直接给答案"
-      }
-    }
-  ]
-}
-
-请只输出 JSON，不要其他说明。"""
-
+            image_base64, mime_type = _optimize_image(image_base64, mime_type)
             text = ""
             if self.provider == "zhipu":
-                text = self._call_zhipu_with_image(prompt, image_base64, mime_type)
+                text = self._call_zhipu_with_image(IMAGE_ANALYSIS_PROMPT, image_base64, mime_type)
             else:
                 text = _call_gemini_rest_with_image(
                     self.gemini_api_key,
                     self.gemini_model,
-                    prompt,
+                    IMAGE_ANALYSIS_PROMPT,
                     image_base64,
                     mime_type=mime_type,
-                    timeout=self.timeout
+                    timeout=self.timeout,
+                    expect_json=True
                 )
+            result = self._parse_image_analysis(text)
+            if result is not None:
+                self._vision_cache.put(cache_key, result)
+            return result
             
-            # 清理可能的 markdown 标记
-            if text.startswith("```"):
-                text = text.split("```")[1]
-                if text.startswith("json"):
-                    text = text[4:]
-            text = text.strip()
-            
-            # 解析 JSON
-            try:
-                data = self._extract_json(text)
-            except Exception as e:
-                print(f"JSON Parse Error (analyze_physics_image): {e}")
-                return None
-            
-            # 验证必要字段
-            if not data.get("topic") or not data.get("question_context") or not data.get("guided_steps"):
-                return None
-            
-            # 构造完整的 Question dict
-            return {
-                "topic": data.get("topic", "物理综合题"),
-                "difficulty": data.get("difficulty", "中考"),
-                "image": None,  # 上传的图片由调用者设置
-                "question_context": {
-                    "description": data["question_context"].get("description", ""),
-                    "ask": data["question_context"].get("ask", [])
-                },
-                "guided_steps": [
-                    {
-                        "step_id": step.get("step_id", idx + 1),
-                        "type": step.get("type", "concept_judgement"),
-                        "prompt": step.get("prompt", ""),
-                        "options": step.get("options", []),
-                        "correct": step.get("correct", "A"),
-                        "feedback": {
-                            "correct": step.get("feedback", {}).get("correct", ""),
-                            "incorrect": step.get("feedback", {}).get("incorrect", "")
-                        }
-                    }
-                    for idx, step in enumerate(data.get("guided_steps", []))
-                ],
-                "next_similar_question_id": None
-            }
+        except Exception:
+            logger.exception("LLM API error (analyze_physics_image)")
+            return None
+
+    async def a_analyze_physics_image(
+        self,
+        image_base64: str,
+        mime_type: str = "image/png"
+    ) -> Optional[Dict]:
+        """
+        analyze_physics_image 的异步版本，不阻塞事件循环。
+        """
+        if not self.is_configured():
+            return None
+        
+        cache_key = self._vision_cache_key(image_base64, IMAGE_ANALYSIS_PROMPT)
+        cached = await asyncio.to_thread(self._vision_cache.get, cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            image_base64, mime_type = await asyncio.to_thread(_optimize_image, image_base64, mime_type)
+            text = ""
+            if self.provider == "zhipu":
+                text = await asyncio.to_thread(
+                    self._call_zhipu_with_image, IMAGE_ANALYSIS_PROMPT, image_base64, mime_type
+                )
+            else:
+                text = await _acall_gemini_rest_with_image(
+                    self.gemini_api_key,
+                    self.gemini_model,
+                    IMAGE_ANALYSIS_PROMPT,
+                    image_base64,
+                    mime_type=mime_type,
+                    timeout=self.timeout,
+                    expect_json=True
+                )
+            result = self._parse_image_analysis(text)
+            if result is not None:
+                await asyncio.to_thread(self._vision_cache.put, cache_key, result)
+            return result
             
+        except Exception:
+            logger.exception("LLM API error (analyze_physics_image)")
+            return None
+
+    def _parse_image_analysis(self, text: str) -> Optional[Dict]:
+        """Turn the model's image-analysis reply into a Question dict (None if unusable)."""
+        # 清理可能的 markdown 标记
+        if text.startswith("```"):
+            text = text.split("```")[1]
+            if text.startswith("json"):
+                text = text[4:]
+        text = text.strip()
+        
+        # 解析 JSON
+        try:
+            data = self._loads_json_object(text)
         except Exception as e:
-            print(f"LLM API error (analyze_physics_image): {e}")
+            logger.warning("JSON Parse Error (analyze_physics_image): %s", e)
+            return None
+        
+        # 验证必要字段
+        if not data.get("topic") or not data.get("question_context") or not data.get("guided_steps"):
             return None
+        
+        # 构造完整的 Question dict
+        return {
+            "topic": data.get("topic", "物理综合题"),
+            "difficulty": data.get("difficulty", "中考"),
+            "image": None,  # 上传的图片由调用者设置
+            "question_context": {
+                "description": data["question_context"].get("description", ""),
+                "ask": data["question_context"].get("ask", [])
+            },
+            "guided_steps": [
+                {
+                    "step_id": step.get("step_id", idx + 1),
+                    "type": step.get("type", "concept_judgement"),
+                    "prompt": step.get("prompt", ""),
+                    "options": step.get("options", []),
+                    "correct": step.get("correct", "A"),
+                    "feedback": {
+                        "correct": step.get("feedback", {}).get("correct", ""),
+                        "incorrect": step.get("feedback", {}).get("incorrect", "")
+                    }
+                }
+                for idx, step in enumerate(data.get("guided_steps", []))
+            ],
+            "next_similar_question_id": None
+        }
 
 
 # Global LLM service instance
@@ -2,18 +2,60 @@
 PhysiTutor-AI Logging Module
 Records all dialogue interactions for analysis.
 """
-import json
-from datetime import datetime
+import asyncio
+import atexit
+import mmap
+import queue
+import struct
+import threading
+from collections import defaultdict, deque
+from itertools import islice
 from pathlib import Path
-from typing import Optional, List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
 
 from app.models.schemas import DialogueLog, SessionSummary
 from config.settings import settings
 
+# Fixed-size sidecar index record: line offset and length in the log, key ids
+# of session_id, question_id and step_id, and is_correct
+_INDEX_RECORD = struct.Struct("<QIIIIB")
+
+
+def _tail_lines(path: Path, n: int, block_size: int = 64 * 1024) -> List[bytes]:
+    """Last n non-empty lines of a file, reading backwards in blocks instead of the whole file."""
+    if n <= 0:
+        return []
+    lines: List[bytes] = []
+    with open(path, "rb") as f:
+        pos = f.seek(0, 2)
+        partial = b""
+        while pos > 0 and len(lines) < n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            parts = (f.read(step) + partial).split(b"\n")
+            # The first piece may continue further back, so it waits for the next block
+            partial = parts[0]
+            lines[:0] = [line for line in parts[1:] if line]
+        if pos == 0 and partial:
+            lines.insert(0, partial)
+    return lines[-n:]
+
 
 class DialogueLogger:
     """Logger for recording dialogue interactions to JSONL files."""
     
+    # Upper bound on entries kept in memory for get_recent_logs
+    RECENT_LOGS_MAXLEN = 10_000
+    # Interaction lines are appended to disk in batches by a background thread
+    FLUSH_INTERVAL_SECONDS = 0.2
+    FLUSH_BATCH_SIZE = 100
+    PENDING_MAXSIZE = 1024
+    # A drain is split into writes of at most this many bytes
+    WRITE_CHUNK_BYTES = 1 << 20
+    
     def __init__(self):
         """Initialize the logger and ensure log directory exists."""
         self.logs_dir = settings.logs_dir
@@ -22,6 +64,247 @@ class DialogueLogger:
         # Main log file (JSONL format for easy streaming analysis)
         self.log_file = self.logs_dir / "dialogue_logs.jsonl"
         self.summary_file = self.logs_dir / "session_summaries.jsonl"
+        # Sidecar index: one packed _INDEX_RECORD per log line. Its string fields
+        # are ids into the key table, which holds one JSON value per line.
+        self.index_file = self.logs_dir / "dialogue_logs.idx"
+        self.keys_file = self.logs_dir / "dialogue_logs.keys"
+        
+        # session_id -> [(offset, length)] of its log lines, loaded on first query
+        self._by_session: Optional[Dict[str, List[Tuple[int, int]]]] = None
+        # question_id -> step_id -> [correct, total], kept up to date from the same index records
+        self._step_counts: Optional[Dict[str, Dict[int, List[int]]]] = None
+        # Key table: id -> value and value -> id
+        self._keys: list = []
+        self._key_ids: dict = {}
+        
+        # Tail of the log file as raw JSON lines, seeded from disk on first read
+        self._recent: Optional[deque] = None
+        
+        # (serialized line, session_id, question_id, step_id, is_correct) waiting to be appended to log_file
+        self._pending: "queue.Queue[Tuple[bytes, str, str, int, bool]]" = queue.Queue(maxsize=self.PENDING_MAXSIZE)
+        self._write_lock = threading.Lock()
+        # Entries taken off the queue whose write failed; retried first by the next flush
+        self._unwritten: List[Tuple[bytes, str, str, int, bool]] = []
+        
+        # Append handles kept open for the process lifetime; all writes go through _write_lock
+        self._log_fh = open(self.log_file, "ab")
+        self._index_fh = open(self.index_file, "ab")
+        self._keys_fh = open(self.keys_file, "ab")
+        self._summary_fh = open(self.summary_file, "ab")
+        
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="dialogue-log-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+    
+    def _flush_loop(self) -> None:
+        """Background thread: write pending lines every interval, or sooner when a batch fills."""
+        while not self._closed.is_set():
+            self._wakeup.wait(self.FLUSH_INTERVAL_SECONDS)
+            self._wakeup.clear()
+            if self._closed.is_set():
+                break  # close() does the final flush
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing dialogue logs: {e}")
+    
+    def flush(self) -> None:
+        """
+        Append all pending interaction lines to the log file, then index them.
+        
+        Lines are coalesced into as few writes as possible, each capped at
+        WRITE_CHUNK_BYTES; queue order is preserved. If the write fails the
+        batch is kept for the next flush and the error is raised.
+        """
+        with self._write_lock:
+            entries, self._unwritten = self._unwritten, []
+            while True:
+                try:
+                    entries.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            if not entries:
+                return
+            if self._log_fh.closed:
+                self._unwritten = entries
+                raise ValueError("I/O operation on closed DialogueLogger")
+            # New records are numbered against the key table, so it must be loaded first
+            self._ensure_index()
+            start = offset = self._log_fh.tell()
+            records = []
+            try:
+                chunk: List[bytes] = []
+                chunk_bytes = 0
+                for line, session_id, question_id, step_id, is_correct in entries:
+                    if chunk and chunk_bytes + len(line) > self.WRITE_CHUNK_BYTES:
+                        self._log_fh.write(b"".join(chunk))
+                        chunk, chunk_bytes = [], 0
+                    chunk.append(line)
+                    chunk_bytes += len(line)
+                    records.append((offset, len(line), session_id, question_id, step_id, is_correct))
+                    offset += len(line)
+                self._log_fh.write(b"".join(chunk))
+                self._log_fh.flush()
+            except Exception:
+                # Keep the batch, and drop whatever part of it reached the file
+                self._unwritten = entries
+                try:
+                    self._log_fh.truncate(start)
+                except (OSError, ValueError):
+                    pass
+                raise
+            self._append_index(records)
+    
+    async def aflush(self) -> None:
+        """flush() for async callers: the file I/O runs on a worker thread."""
+        await asyncio.to_thread(self.flush)
+    
+    def _append_index(self, records: List[tuple]) -> None:
+        """Persist (offset, length, sid, qid, step, ok) records and mirror them into the in-memory maps."""
+        known = len(self._keys)
+        packed = b"".join(
+            _INDEX_RECORD.pack(offset, length, self._key_id(sid), self._key_id(qid), self._key_id(step), ok)
+            for offset, length, sid, qid, step, ok in records
+        )
+        if len(self._keys) > known:
+            # Keys go to disk before the records that refer to them
+            self._keys_fh.write(b"".join(
+                orjson.dumps(key, option=orjson.OPT_APPEND_NEWLINE) for key in self._keys[known:]
+            ))
+            self._keys_fh.flush()
+        self._index_fh.write(packed)
+        self._index_fh.flush()
+        for record in records:
+            self._add_to_index(*record)
+    
+    def _key_id(self, value) -> int:
+        key_id = self._key_ids.get(value)
+        if key_id is None:
+            key_id = self._key_ids[value] = len(self._keys)
+            self._keys.append(value)
+        return key_id
+    
+    def _add_to_index(self, offset: int, length: int, sid: str, qid: str, step: int, ok: bool) -> None:
+        self._by_session[sid].append((offset, length))
+        counts = self._step_counts[qid][step]
+        counts[1] += 1
+        if ok:
+            counts[0] += 1
+    
+    def _ensure_index(self) -> None:
+        """
+        Load the offset index on first use. Log lines it does not cover yet
+        (written before the index existed, or before a crash could index them)
+        are indexed from the log itself.
+        """
+        if self._by_session is not None:
+            return
+        self._by_session = defaultdict(list)
+        self._step_counts = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        covered = 0
+        stale = False
+        if self.keys_file.exists():
+            data = self.keys_file.read_bytes()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                self._keys_fh.truncate(end)  # torn write
+            self._keys = [orjson.loads(line) for line in data[:end].splitlines()]
+            self._key_ids = {key: key_id for key_id, key in enumerate(self._keys)}
+        if self.index_file.exists():
+            data = self.index_file.read_bytes()
+            end = len(data) - len(data) % _INDEX_RECORD.size
+            if end < len(data):
+                self._index_fh.truncate(end)  # torn write
+            keys = self._keys
+            try:
+                for offset, length, sid, qid, step, ok in _INDEX_RECORD.iter_unpack(memoryview(data)[:end]):
+                    self._add_to_index(offset, length, keys[sid], keys[qid], keys[step], ok)
+                    covered = max(covered, offset + length)
+            except IndexError:
+                stale = True  # refers to keys that never reached disk
+        
+        log_size = self.log_file.stat().st_size if self.log_file.exists() else 0
+        if stale or covered > log_size:
+            # The log was truncated or replaced under the index: rebuild it from scratch
+            self._index_fh.truncate(0)
+            self._keys_fh.truncate(0)
+            self._keys, self._key_ids = [], {}
+            self._by_session.clear()
+            self._step_counts.clear()
+            covered = 0
+        if log_size <= covered:
+            return
+        missing = []
+        with open(self.log_file, "rb") as f:
+            f.seek(covered)
+            offset = covered
+            for line in f:
+                if len(line) > 1:  # skip bare newlines
+                    try:
+                        log = orjson.loads(line)
+                        missing.append((
+                            offset,
+                            len(line),
+                            log.get("session_id"),
+                            log.get("question_id"),
+                            log.get("step_id"),
+                            bool(log.get("is_correct", False)),
+                        ))
+                    except orjson.JSONDecodeError:
+                        pass
+                offset += len(line)
+        if missing:
+            self._append_index(missing)
+    
+    def _session_lines(self, session_id: str) -> Iterator[memoryview]:
+        """
+        Yield just the log lines the index lists for session_id.
+        
+        The log is mapped read-only and each line is a memoryview slice of the
+        mapping, so lookups cost neither a read syscall nor a copy per line.
+        Slices are only valid until the next one is requested.
+        """
+        with self._write_lock:
+            self._ensure_index()
+            spans = list(self._by_session.get(session_id, ()))
+        if not spans:
+            return
+        with open(self.log_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                for offset, length in spans:
+                    with view[offset:offset + length] as line:
+                        yield line
+    
+    def close(self) -> None:
+        """
+        Stop the flusher thread, write out pending lines and close the log
+        files (registered with atexit). Logging afterwards raises ValueError.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wakeup.set()
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
+        atexit.unregister(self.close)
+        try:
+            self.flush()
+        finally:
+            with self._write_lock:
+                for fh in (self._log_fh, self._index_fh, self._keys_fh, self._summary_fh):
+                    fh.close()
+    
+    def _recent_buffer(self) -> deque:
+        """Return the bounded in-memory tail, loading it from the end of the log file once."""
+        if self._recent is None:
+            self.flush()
+            recent = deque(maxlen=self.RECENT_LOGS_MAXLEN)
+            if self.log_file.exists():
+                recent.extend(_tail_lines(self.log_file, self.RECENT_LOGS_MAXLEN))
+            self._recent = recent
+        return self._recent
     
     def log_interaction(self, log_entry: DialogueLog) -> None:
         """
@@ -30,12 +313,33 @@ class DialogueLogger:
         Args:
             log_entry: The dialogue log entry to record
         """
-        log_dict = log_entry.model_dump()
-        # Convert datetime to ISO format string
-        log_dict["timestamp"] = log_dict["timestamp"].isoformat()
+        if self._closed.is_set():
+            raise ValueError("I/O operation on closed DialogueLogger")
+        
+        # Serialized straight to JSON bytes by pydantic, no intermediate dict
+        line = log_entry.model_dump_json().encode() + b"\n"
         
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(log_dict, ensure_ascii=False) + "\n")
+        entry = (
+            line,
+            log_entry.session_id,
+            log_entry.question_id,
+            log_entry.step_id,
+            log_entry.is_correct,
+        )
+        try:
+            self._pending.put_nowait(entry)
+        except queue.Full:
+            # Writer fell behind; drain inline rather than drop the entry
+            self.flush()
+            self._pending.put(entry)
+        if self._closed.is_set():
+            # close() may have done its final flush since the check above
+            self.flush()
+        elif self._pending.qsize() >= self.FLUSH_BATCH_SIZE:
+            self._wakeup.set()
+        
+        if self._recent is not None:
+            self._recent.append(line)
     
     def log_session_summary(self, summary: SessionSummary) -> None:
         """
@@ -44,11 +348,22 @@ class DialogueLogger:
         Args:
             summary: The session summary to record
         """
-        summary_dict = summary.model_dump()
-        summary_dict["completed_at"] = summary_dict["completed_at"].isoformat()
+        self.log_session_summaries([summary])
+    
+    def log_session_summaries(self, summaries: Iterable[SessionSummary]) -> None:
+        """
+        Record several session summaries with a single write.
+        
+        Args:
+            summaries: The session summaries to record, in order
+        """
+        chunk = b"".join(summary.model_dump_json().encode() + b"\n" for summary in summaries)
+        if not chunk:
+            return
         
-        with open(self.summary_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(summary_dict, ensure_ascii=False) + "\n")
+        with self._write_lock:
+            self._summary_fh.write(chunk)
+            self._summary_fh.flush()
     
     def get_session_logs(self, session_id: str) -> List[DialogueLog]:
         """
@@ -60,19 +375,12 @@ class DialogueLogger:
         Returns:
             List of DialogueLog entries for the session
         """
-        logs = []
-        if not self.log_file.exists():
-            return logs
-        
-        with open(self.log_file, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    log_dict = json.loads(line)
-                    if log_dict.get("session_id") == session_id:
-                        log_dict["timestamp"] = datetime.fromisoformat(log_dict["timestamp"])
-                        logs.append(DialogueLog(**log_dict))
-        
-        return logs
+        self.flush()
+        # One validating parse per line (pydantic takes bytes, not memoryview)
+        return [
+            DialogueLog.model_validate_json(bytes(line))
+            for line in self._session_lines(session_id)
+        ]
     
     def get_recent_logs(self, limit: int = 100) -> List[dict]:
         """
@@ -84,16 +392,10 @@ class DialogueLogger:
         Returns:
             List of recent log entries as dictionaries
         """
-        logs = []
-        if not self.log_file.exists():
-            return logs
-        
-        with open(self.log_file, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    logs.append(json.loads(line))
-        
-        return logs[-limit:]
+        # Only the returned entries are parsed
+        logs = list(map(orjson.loads, islice(reversed(self._recent_buffer()), max(limit, 0))))
+        logs.reverse()
+        return logs
     
     def get_question_stats(self, question_id: str) -> dict:
         """
@@ -105,30 +407,20 @@ class DialogueLogger:
         Returns:
             Dictionary with question statistics
         """
+        self.flush()
         if not self.log_file.exists():
             return {"question_id": question_id, "total_attempts": 0}
         
-        step_stats = {}
-        total_correct = 0
-        total_attempts = 0
-        
-        with open(self.log_file, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    log = json.loads(line)
-                    if log.get("question_id") == question_id:
-                        step_id = log.get("step_id")
-                        is_correct = log.get("is_correct", False)
-                        
-                        if step_id not in step_stats:
-                            step_stats[step_id] = {"correct": 0, "total": 0}
-                        
-                        step_stats[step_id]["total"] += 1
-                        total_attempts += 1
-                        
-                        if is_correct:
-                            step_stats[step_id]["correct"] += 1
-                            total_correct += 1
+        # Counts come straight from the index; the log itself is not read or parsed
+        with self._write_lock:
+            self._ensure_index()
+            counts = self._step_counts.get(question_id, {})
+            step_stats = {
+                step_id: {"correct": correct, "total": total}
+                for step_id, (correct, total) in counts.items()
+            }
+        total_correct = sum(step["correct"] for step in step_stats.values())
+        total_attempts = sum(step["total"] for step in step_stats.values())
         
         return {
             "question_id": question_id,
@@ -2,7 +2,7 @@
 PhysiTutor-AI Utility Functions
 """
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 import json
 
 
@@ -36,3 +36,16 @@ def calculate_accuracy(correct: int, total: int) -> float:
 def format_accuracy(accuracy: float) -> str:
     """Format accuracy as percentage string."""
     return f"{accuracy:.1%}"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def sse_event(event: str, data: Any) -> bytes:
+    """Encode one Server-Sent Events message with a JSON data payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
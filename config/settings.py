@@ -2,6 +2,7 @@
 PhysiTutor-AI Configuration Settings
 """
 import os
+from functools import lru_cache
 from pathlib import Path
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
@@ -25,10 +26,13 @@ class Settings(BaseSettings):
     # Gemini API
     gemini_api_key: str = os.getenv("GEMINI_API_KEY", "")
     gemini_model: str = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    # Cheaper tier for short per-click feedback
+    gemini_model_fast: str = os.getenv("GEMINI_MODEL_FAST", "gemini-1.5-flash-8b")
     
     # Zhipu AI API
     zhipu_api_key: str = os.getenv("ZHIPU_API_KEY", "")
     zhipu_model: str = "glm-4"
+    zhipu_model_fast: str = "glm-4-flash"
     zhipu_vision_model: str = "glm-4v"
     
     # Application
@@ -42,6 +46,8 @@ class Settings(BaseSettings):
     prompts_dir: Path = PROJECT_ROOT / "config" / "prompts"
     questions_dir: Path = PROJECT_ROOT / "data" / "questions"
     logs_dir: Path = PROJECT_ROOT / "data" / "logs"
+    cache_dir: Path = PROJECT_ROOT / "data" / "cache"
+    uploads_dir: Path = PROJECT_ROOT / "static" / "uploads"
     
     class Config:
         env_file = ".env"
@@ -52,8 +58,9 @@ class Settings(BaseSettings):
 settings = Settings()
 
 
+@lru_cache(maxsize=1)
 def get_system_prompt() -> str:
-    """Load the tutor system prompt from file."""
+    """Load the tutor system prompt from file (read once per process)."""
     prompt_file = settings.prompts_dir / "tutor_system.md"
     if prompt_file.exists():
         return prompt_file.read_text(encoding="utf-8")
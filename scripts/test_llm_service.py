@@ -1,43 +1,68 @@
 #!/usr/bin/env python3
 """测试脚本：验证能否成功调用 Gemini API。"""
+import asyncio
+import re
 import socket
 import sys
+from functools import lru_cache
 from pathlib import Path
+from typing import List
 
 # 确保项目根目录在 Python 路径中
 PROJECT_ROOT = Path(__file__).resolve().parent
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-# 强制使用 IPv4，避免在 IPv6 不可达的网络下连接超时
+# 强制使用 IPv4，避免在 IPv6 不可达的网络下连接超时；解析结果缓存，重试时不再重复查 DNS
 _orig_getaddrinfo = socket.getaddrinfo
+@lru_cache(maxsize=128)
 def _getaddrinfo_ipv4(host, port, family=0, type=0, proto=0, flags=0):
     return _orig_getaddrinfo(host, port, socket.AF_INET, type, proto, flags)
 socket.getaddrinfo = _getaddrinfo_ipv4
 
 
-def call_gemini_rest(api_key: str, model: str, prompt: str, timeout: int = 60) -> str:
-    import requests
-    from requests.adapters import HTTPAdapter
-    from urllib3.util.retry import Retry
+# 与 app/services/llm_service.py 一致：遇到限流/服务端错误时退避重试
+RETRY_TOTAL = 2
+RETRY_BACKOFF = 1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+async def call_gemini_rest(client, api_key: str, model: str, prompt: str, timeout: int = 60) -> str:
+    import httpx
+    import orjson
 
     url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
     headers = {"Content-Type": "application/json", "X-goog-api-key": api_key}
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    body = orjson.dumps({"contents": [{"parts": [{"text": prompt}]}]})
+
+    for attempt in range(RETRY_TOTAL + 1):
+        if attempt:
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            resp = await client.post(url, headers=headers, content=body, timeout=timeout)
+        except httpx.TransportError:
+            if attempt == RETRY_TOTAL:
+                raise
+            continue
+        if resp.status_code in RETRY_STATUSES and attempt < RETRY_TOTAL:
+            continue
+        resp.raise_for_status()
+        result = orjson.loads(resp.content)
+        return result["candidates"][0]["content"]["parts"][0]["text"].strip()
+
+
+async def call_gemini_batch(api_key: str, model: str, prompts: List[str], timeout: int = 60) -> List[str]:
+    """并发发送多条 prompt，共用一个 httpx.AsyncClient 连接池。"""
+    import httpx
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        return await asyncio.gather(
+            *(call_gemini_rest(client, api_key, model, prompt, timeout) for prompt in prompts)
+        )
 
-    session = requests.Session()
-    retry = Retry(
-        total=2,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["POST"],
-    )
-    session.mount("https://", HTTPAdapter(max_retries=retry))
 
-    resp = session.post(url, headers=headers, json=payload, timeout=timeout)
-    resp.raise_for_status()
-    result = resp.json()
-    return result["candidates"][0]["content"]["parts"][0]["text"].strip()
+# .env 中的 KEY=VALUE 行；注释行与空行不匹配
+_ENV_LINE = re.compile(r"^[ \t]*([A-Za-z_][A-Za-z0-9_]*)[ \t]*=(.*)$", re.M)
 
 
 def _load_env():
@@ -46,16 +71,8 @@ def _load_env():
     env_file = PROJECT_ROOT / ".env"
     if not env_file.is_file():
         return
-    with open(env_file, encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            if "=" in line:
-                key, _, value = line.partition("=")
-                key, value = key.strip(), value.strip().strip('"\'')
-                if key:
-                    os.environ.setdefault(key, value)
+    for key, value in _ENV_LINE.findall(env_file.read_text(encoding="utf-8")):
+        os.environ.setdefault(key, value.strip().strip('"\''))
 
 
 def main():
@@ -77,7 +94,9 @@ def main():
 
     timeout_sec = 60
     try:
-        text = call_gemini_rest(api_key, model_name, "用10个字描述一个人的性格特点", timeout=timeout_sec)
+        text, = asyncio.run(
+            call_gemini_batch(api_key, model_name, ["用10个字描述一个人的性格特点"], timeout=timeout_sec)
+        )
         print(text)
         return 0
     except Exception as e:
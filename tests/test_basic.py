@@ -1,15 +1,55 @@
 """
 Basic tests for PhysiTutor-AI
 """
+import json
+
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
 from app.main import app
+from app.models.database import Base, Session, User
+from app.models.schemas import DialogueLog
+from app.services.llm_service import llm_service
+from app.services.logger import _INDEX_RECORD, DialogueLogger
+from config.settings import settings
 
 
 client = TestClient(app)
 
 
+@pytest.fixture(scope="session", autouse=True)
+def app_lifespan():
+    """Run the app's startup and shutdown once around the whole test run."""
+    with client:
+        yield
+
+
+@pytest.fixture(scope="session")
+def question_ids():
+    """IDs of the available questions, fetched once for the whole run."""
+    response = client.get("/session/")
+    return [question["id"] for question in response.json()["available_questions"]]
+
+
+@pytest.fixture
+def active_session(question_ids):
+    """Start a session on the first question and end it after the test."""
+    if not question_ids:
+        pytest.skip("No questions available for testing")
+    response = client.post(
+        "/session/start",
+        json={"question_id": question_ids[0]}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    yield data
+    
+    # Clean up
+    client.post(f"/session/{data['session_id']}/end")
+
+
 class TestRootEndpoints:
     """Test root and health endpoints."""
     
@@ -27,6 +67,15 @@ class TestRootEndpoints:
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "healthy"
+    
+    def test_favicon_revalidation(self):
+        """Test cached static assets answer a matching If-None-Match with 304."""
+        response = client.get("/favicon.ico")
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        
+        response = client.get("/favicon.ico", headers={"If-None-Match": etag})
+        assert response.status_code == 304
 
 
 class TestSessionEndpoints:
@@ -40,6 +89,14 @@ class TestSessionEndpoints:
         assert "available_questions" in data
         assert "count" in data
     
+    def test_list_questions_revalidation(self):
+        """Test the question list answers a matching If-None-Match with 304."""
+        response = client.get("/session/")
+        etag = response.headers["etag"]
+        
+        response = client.get("/session/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+    
     def test_start_session_invalid_question(self):
         """Test starting session with invalid question ID."""
         response = client.post(
@@ -48,24 +105,10 @@ class TestSessionEndpoints:
         )
         assert response.status_code == 404
     
-    def test_start_session_valid(self):
+    def test_start_session_valid(self, active_session):
         """Test starting a valid session."""
-        # First get available questions
-        questions_response = client.get("/session/")
-        questions = questions_response.json()["available_questions"]
-        
-        if questions:
-            response = client.post(
-                "/session/start",
-                json={"question_id": questions[0]}
-            )
-            assert response.status_code == 200
-            data = response.json()
-            assert "session_id" in data
-            assert data["status"] == "active"
-            
-            # Clean up
-            client.post(f"/session/{data['session_id']}/end")
+        assert "session_id" in active_session
+        assert active_session["status"] == "active"
 
 
 class TestDialogueEndpoints:
@@ -84,49 +127,260 @@ class TestDialogueEndpoints:
         )
         assert response.status_code == 404
     
-    def test_full_dialogue_flow(self):
+    def test_full_dialogue_flow(self, active_session):
         """Test a complete dialogue flow."""
-        # Get available questions
-        questions_response = client.get("/session/")
-        questions = questions_response.json()["available_questions"]
+        session_id = active_session["session_id"]
         
-        if not questions:
-            pytest.skip("No questions available for testing")
+        # Get current step
+        step_response = client.get(f"/dialogue/{session_id}/current")
+        assert step_response.status_code == 200
+        step_data = step_response.json()
+        assert "prompt" in step_data
+        assert "options" in step_data
         
-        # Start session
-        start_response = client.post(
-            "/session/start",
-            json={"question_id": questions[0]}
+        # Submit a choice
+        submit_response = client.post(
+            f"/dialogue/{session_id}/submit",
+            json={"choice": "A"}
+        )
+        assert submit_response.status_code == 200
+        feedback_data = submit_response.json()
+        assert "is_correct" in feedback_data
+        assert "feedback" in feedback_data
+        
+        # Check history
+        history_response = client.get(f"/dialogue/{session_id}/history")
+        assert history_response.status_code == 200
+        history_data = history_response.json()
+        assert len(history_data["history"]) > 0
+    
+    def test_reasoning_stream_events(self, active_session, monkeypatch):
+        """Test the reasoning stream sends plain-text deltas, then the result, as SSE."""
+        reply = '{"evaluation": "思路正确\\n很好", "standard_solution": "m = ρV"}'
+        
+        async def fake_stream(prompt, expect_json=False, tier="default", system=False):
+            for i in range(0, len(reply), 5):
+                yield reply[i:i + 5]
+        
+        monkeypatch.setattr(llm_service, "is_configured", lambda: True)
+        monkeypatch.setattr(llm_service, "_astream_content", fake_stream)
+        
+        response = client.post(
+            f"/dialogue/{active_session['session_id']}/reasoning/stream",
+            json={"text": "先求体积，再用密度求质量"}
         )
-        session_id = start_response.json()["session_id"]
-        
-        try:
-            # Get current step
-            step_response = client.get(f"/dialogue/{session_id}/current")
-            assert step_response.status_code == 200
-            step_data = step_response.json()
-            assert "prompt" in step_data
-            assert "options" in step_data
-            
-            # Submit a choice
-            submit_response = client.post(
-                f"/dialogue/{session_id}/submit",
-                json={"choice": "A"}
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text.endswith("\n\n")
+        
+        events = []
+        for message in response.text.split("\n\n")[:-1]:
+            event_line, data_line = message.split("\n")
+            assert event_line.startswith("event: ")
+            assert data_line.startswith("data: ")
+            events.append((event_line[len("event: "):], json.loads(data_line[len("data: "):])))
+        
+        *deltas, (last_event, result) = events
+        assert deltas and all(event == "delta" for event, _ in deltas)
+        streamed = {"evaluation": "", "standard_solution": ""}
+        for _, delta in deltas:
+            streamed[delta["field"]] += delta["text"]
+        assert streamed == {"evaluation": "思路正确\n很好", "standard_solution": "m = ρV"}
+        assert last_event == "result"
+        assert result["ai_evaluation"] == "思路正确\n很好"
+        assert result["standard_solution"] == "m = ρV"
+
+
+class TestDatabase:
+    """Test database models."""
+    
+    def test_created_at_on_preexisting_tables(self, tmp_path):
+        """Rows get created_at in tables created before the column had a DB default."""
+        engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) NOT NULL UNIQUE, "
+                "created_at DATETIME)"
+            )
+            conn.exec_driver_sql(
+                "CREATE TABLE sessions (id VARCHAR(36) PRIMARY KEY, user_id INTEGER REFERENCES users (id), "
+                "question_id VARCHAR(100) NOT NULL, status VARCHAR(20), current_step_id INTEGER, "
+                "correct_count INTEGER, retry_count INTEGER, created_at DATETIME, completed_at DATETIME)"
             )
-            assert submit_response.status_code == 200
-            feedback_data = submit_response.json()
-            assert "is_correct" in feedback_data
-            assert "feedback" in feedback_data
-            
-            # Check history
-            history_response = client.get(f"/dialogue/{session_id}/history")
-            assert history_response.status_code == 200
-            history_data = history_response.json()
-            assert len(history_data["history"]) > 0
-            
-        finally:
-            # Clean up
-            client.post(f"/session/{session_id}/end")
+        Base.metadata.create_all(engine)
+        
+        with sessionmaker(bind=engine)() as db:
+            user = User(username="old_schema")
+            db.add(user)
+            db.flush()
+            db.add(Session(id="sess_old_schema", user_id=user.id, question_id="q1"))
+            db.commit()
+            assert db.query(User).one().created_at is not None
+            assert db.query(Session).one().created_at is not None
+        engine.dispose()
+
+
+
+def _dialogue_log(session_id, question_id, step_id, is_correct):
+    return DialogueLog(
+        session_id=session_id,
+        question_id=question_id,
+        step_id=step_id,
+        granularity="concept_judgement",
+        student_choice="A",
+        expected_choice="A" if is_correct else "B",
+        ai_feedback="反馈",
+        is_correct=is_correct,
+        prompt_version="v1.0"
+    )
+
+
+def _scan_log(log_file):
+    """Every entry of the log file, parsed line by line (the pre-index behaviour)."""
+    with open(log_file, "rb") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _scan_question_stats(entries, question_id):
+    step_stats = {}
+    for entry in entries:
+        if entry["question_id"] == question_id:
+            step = step_stats.setdefault(entry["step_id"], {"correct": 0, "total": 0})
+            step["total"] += 1
+            step["correct"] += entry["is_correct"]
+    total = sum(step["total"] for step in step_stats.values())
+    correct = sum(step["correct"] for step in step_stats.values())
+    return {
+        "question_id": question_id,
+        "total_attempts": total,
+        "overall_accuracy": correct / total if total else 0,
+        "step_stats": step_stats
+    }
+
+
+class _FailOnce:
+    """File proxy whose first write fails, like a momentarily full disk."""
+    
+    def __init__(self, fh):
+        self.fh = fh
+        self.failed = False
+    
+    def write(self, data):
+        if not self.failed:
+            self.failed = True
+            raise OSError("No space left on device")
+        return self.fh.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.fh, name)
+
+
+class TestDialogueLogger:
+    """Test the indexed log queries against a full scan of the log file."""
+    
+    SESSIONS = ("sess_a", "sess_b")
+    QUESTIONS = ("q1", "q2")
+    
+    @pytest.fixture
+    def logs_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "logs_dir", tmp_path)
+        return tmp_path
+    
+    def _write_entries(self, count, start=0):
+        """Log count entries, alternating sessions so their lines interleave."""
+        logger = DialogueLogger()
+        for i in range(start, start + count):
+            logger.log_interaction(_dialogue_log(
+                self.SESSIONS[i % 2], self.QUESTIONS[i % 3 % 2], i % 4 + 1, i % 3 != 0
+            ))
+        logger.close()
+    
+    def _assert_matches_scan(self, logger):
+        logger.flush()
+        entries = _scan_log(logger.log_file)
+        assert entries
+        for session_id in self.SESSIONS + ("sess_missing",):
+            expected = [DialogueLog(**entry) for entry in entries if entry["session_id"] == session_id]
+            assert logger.get_session_logs(session_id) == expected
+        for question_id in self.QUESTIONS + ("q_missing",):
+            assert logger.get_question_stats(question_id) == _scan_question_stats(entries, question_id)
+    
+    def test_session_logs_match_full_scan(self, logs_dir):
+        """Test indexed lookups return the same entries, in order, as parsing the whole file."""
+        self._write_entries(12)
+        
+        # Reopened: the index is loaded from the sidecar files
+        logger = DialogueLogger()
+        self._assert_matches_scan(logger)
+        
+        # Entries logged after the index was loaded are indexed too
+        logger.log_interaction(_dialogue_log("sess_b", "q1", 1, True))
+        self._assert_matches_scan(logger)
+        logger.close()
+    
+    def test_close_stops_flusher(self, logs_dir):
+        """Test close() stops the background thread, writes pending lines and rejects later entries."""
+        logger = DialogueLogger()
+        logger.log_interaction(_dialogue_log("sess_a", "q1", 1, True))
+        logger.close()
+        assert not logger._flusher.is_alive()
+        assert len(_scan_log(logger.log_file)) == 1
+        
+        with pytest.raises(ValueError):
+            logger.log_interaction(_dialogue_log("sess_a", "q1", 2, True))
+        logger.close()  # a second close is a no-op
+    
+    def test_failed_write_keeps_batch(self, logs_dir, monkeypatch):
+        """Test entries whose write fails are written by the next flush, not dropped."""
+        monkeypatch.setattr(DialogueLogger, "FLUSH_INTERVAL_SECONDS", 3600)
+        logger = DialogueLogger()
+        logger._log_fh = _FailOnce(logger._log_fh)
+        logger.log_interaction(_dialogue_log("sess_a", "q1", 1, True))
+        logger.log_interaction(_dialogue_log("sess_b", "q2", 1, False))
+        
+        with pytest.raises(OSError):
+            logger.flush()
+        assert logger.log_file.stat().st_size == 0
+        
+        self._assert_matches_scan(logger)
+        assert len(_scan_log(logger.log_file)) == 2
+        logger.close()
+    
+    @pytest.mark.parametrize("damage", ["torn_tail", "truncated_index", "missing_keys", "missing_index", "log_rotated"])
+    def test_index_recovers_from_damaged_sidecars(self, logs_dir, damage):
+        """Test a damaged or stale index is repaired or rebuilt from the log on reopen."""
+        self._write_entries(12)
+        log_file = logs_dir / "dialogue_logs.jsonl"
+        index_file = logs_dir / "dialogue_logs.idx"
+        keys_file = logs_dir / "dialogue_logs.keys"
+        
+        if damage == "torn_tail":
+            with open(index_file, "ab") as f:
+                f.write(b"\x01\x02\x03")
+            with open(keys_file, "ab") as f:
+                f.write(b'"sess_')
+        elif damage == "truncated_index":
+            index_file.write_bytes(index_file.read_bytes()[:-40])
+        elif damage == "missing_keys":
+            keys_file.unlink()
+        elif damage == "missing_index":
+            index_file.unlink()
+        elif damage == "log_rotated":
+            lines = log_file.read_bytes().splitlines(keepends=True)
+            log_file.write_bytes(b"".join(lines[-3:]))
+        
+        logger = DialogueLogger()
+        self._assert_matches_scan(logger)
+        logger.close()
+        # Torn records were cut off on disk, not just skipped in memory
+        assert index_file.stat().st_size % _INDEX_RECORD.size == 0
+        assert keys_file.read_bytes().endswith(b"\n")
+        
+        # The repaired index keeps working for new entries and the next reopen
+        self._write_entries(5, start=12)
+        logger = DialogueLogger()
+        self._assert_matches_scan(logger)
+        logger.close()
 
 
 if __name__ == "__main__":